@@ -1,12 +1,20 @@
+import bisect
+import functools
 import json
+import re
+import time
 from operator import itemgetter
 import tournament as tournament
-import requests
+from transport import shared_transport
+from scheduler import Priority, SingleFlight, shared_scheduler
+from archive import shared_archive
+from caching import shared_model_cache
+from metrics import shared_metrics
+from tournament_index import matching, shared_tournament_index
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import pytz
 from urllib.parse import urlparse
-from python_graphql_client import GraphqlClient
-from algoliasearch.search_client import SearchClient
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -14,13 +22,229 @@ load_dotenv()
 
 class GGConstant(object):
     melee_type = 1
+    # start.gg rejects queries that may return more than this many objects.
+    complexity_limit = 1000
+    bracket_query_overhead = 4
+    assumed_seeds_per_entrant = 3
+    max_page_workers = int(os.getenv('GG_MAX_PAGE_WORKERS', 4))
+    # How far back of the previous poll an incremental refresh looks, to
+    # allow for clock skew between us and start.gg.
+    refresh_margin = 60
+    # A player's tournaments are fetched this many at a time, and shown
+    # user_page_size at a time.
+    user_tournaments_per_page = 100
+    user_page_size = int(os.getenv('GG_USER_PAGE_SIZE', 50))
+
+
+_in_flight = SingleFlight()
+
+
+def _is_completed(state):
+    # Events and phases report an ActivityState, tournaments and phase groups
+    # the matching integer.
+    return state in ['COMPLETED', 3]
+
+
+# The sets selection shared by the full bracket query and the incremental
+# refresh query.
+_bracket_set_fields = \
+    """
+                  nodes {
+                    id
+                    round
+                    displayScore
+                    winnerId
+                    identifier
+                    wPlacement
+                    completedAt
+                    stream {
+                      streamName
+                      streamSource
+                    }
+                    slots {
+                      prereqId
+                      prereqType
+                      prereqPlacement
+                      slotIndex
+                      entrant {
+                        id
+                        participants {
+                          id
+                          gamerTag
+                        }
+                        seeds {
+                          seedNum
+                          phaseGroup {
+                            id
+                          }
+                        }
+                      }
+                      standing {
+                        stats {
+                          score {
+                            value
+                          }
+                        }
+                      }
+                    }
+                  }
+    """
+
+
+# Built once here rather than on every call, the bracket queries run the most.
+_bracket_page_gql = \
+    """
+            query bracket($phaseGroupId: ID!, $page: Int!, $perPage: Int!, $profileId: ID!) {
+              phaseGroup(id: $phaseGroupId) {
+                bracketType
+                state
+                phase {
+                  name
+                }
+                sets(page: $page, perPage: $perPage, sortType: STANDARD) {
+                  pageInfo {
+                    total
+                    totalPages
+                  }
+                  """ + _bracket_set_fields + """
+                }
+              }
+              tournament(id: $profileId) {
+                name
+              }
+            }
+            """
+
+
+_updated_sets_gql = \
+    """
+            query updatedSets($phaseGroupId: ID!, $updatedAfter: Timestamp!, $page: Int!, $perPage: Int!) {
+              phaseGroup(id: $phaseGroupId) {
+                sets(page: $page, perPage: $perPage, sortType: STANDARD, filters: {updatedAfter: $updatedAfter}) {
+                  pageInfo {
+                    total
+                    totalPages
+                  }
+                  """ + _bracket_set_fields + """
+                }
+              }
+            }
+            """
+
+
+class GGQuery(object):
+    # final, if given, tells from a response whether the data can still
+    # change; final responses are archived and never fetched again. entity,
+    # a (kind, id) pair, names what the response describes so it can be
+    # shared through the model cache by every query for that entity.
+    def __init__(self, gql, variables, parse, final=None, entity=None):
+        self.gql = gql
+        self.variables = variables
+        self.parse = parse
+        self.final = final
+        self.entity = entity
+
+
+_gql_token = re.compile(r'"[^"]*"|[{}()]|([_A-Za-z]\w*)(\s*:)?')
+
+
+def _alias_root_fields(body, prefix):
+    # Puts the prefix on every field directly inside the top-level selection
+    # set, as a new alias or onto an existing one. Arguments, nested
+    # selections and string literals are left alone.
+    depth = 0
+    after_alias = False
+
+    def alias(match):
+        nonlocal depth, after_alias
+        token = match.group(0)
+        if token in ['{', '(']:
+            depth += 1
+        elif token in ['}', ')']:
+            depth -= 1
+        elif match.group(1) and depth == 0:
+            if after_alias:
+                after_alias = False
+            elif match.group(2):
+                after_alias = True
+                return prefix + token
+            else:
+                return f'{prefix}{token}: {token}'
+        return token
+    return _gql_token.sub(alias, body)
+
+
+@functools.lru_cache(maxsize=256)
+def _compose_documents(documents):
+    # The merged document and the variables each query declares. The same
+    # few combinations come up over and over, so they are only worked out
+    # once.
+    names = []
+    definitions = []
+    bodies = []
+    declared = []
+    for i, gql in enumerate(documents):
+        prefix = f'q{i}_'
+        header = re.match(r'\s*query\s+(\w+)\s*(?:\((.*?)\))?\s*\{', gql, re.DOTALL)
+        names.append(header.group(1))
+        query_definitions = header.group(2) or ''
+        declared.append(tuple(re.findall(r'\$(\w+)\s*:', query_definitions)))
+
+        body = gql[header.end():gql.rindex('}')]
+        bodies.append(_alias_root_fields(body.replace('$', f'${prefix}'), prefix))
+
+        if query_definitions:
+            definitions.append(query_definitions.replace('$', f'${prefix}'))
+
+    definitions = f'({", ".join(definitions)})' if definitions else ''
+    return f'query {"_".join(names)}{definitions} {{{"".join(bodies)}}}', tuple(declared)
+
+
+def compose_queries(queries):
+    # Merges several queries into one document so they cost a single round
+    # trip. Each query gets a prefix that is put on its variables and, as an
+    # alias, on its root fields; the response is split back apart by prefix
+    # and handed to each query's own parse.
+    gql, declared = _compose_documents(tuple(query.gql for query in queries))
+    variables = {}
+    for i, (query, names) in enumerate(zip(queries, declared)):
+        variables.update({f'q{i}_{name}': query.variables[name] for name in names})
+
+    def parse(response):
+        return [query.parse(part) for query, part in split_composed(queries, response)]
+
+    def final(response):
+        return all(query.final is not None and query.final(part) for query, part in split_composed(queries, response))
+    return GGQuery(gql, variables, parse, final)
+
+
+def _request_key(query):
+    return (query.gql, json.dumps(query.variables, sort_keys=True))
+
+
+def split_composed(queries, response):
+    data = response.get('data') or {}
+    for i, query in enumerate(queries):
+        prefix = f'q{i}_'
+        part = {'data': {key[len(prefix):]: value for key, value in data.items() if key.startswith(prefix)}}
+        # Errors without a path, like start.gg's complexity errors, are about
+        # the whole request, so every query gets them.
+        errors = [e for e in response.get('errors') or [] if not e.get('path') or str(e['path'][0]).startswith(prefix)]
+        if errors:
+            part['errors'] = errors
+        yield query, part
 
 
 class GGClient(object):
-    def __init__(self, api_endpoint='https://api.start.gg/gql/alpha', logger=None):
+    def __init__(self, api_endpoint='https://api.start.gg/gql/alpha', logger=None, transport=None,
+                 scheduler=None, priority=Priority.INTERACTIVE):
         self.api_endpoint = api_endpoint
         self.logger = logger
-        self.gql_client = GraphqlClient(self.api_endpoint)
+        self.transport = transport or shared_transport()
+        self.scheduler = scheduler or shared_scheduler()
+        self.priority = priority
+        self.archive = shared_archive()
+        self.models = shared_model_cache()
         self.user_agent = 'Mozilla/5.0'
         self.headers = {
             'User-Agent': self.user_agent,
@@ -38,20 +262,117 @@ class GGClient(object):
 
 
     def _execute_gql(self, gql, variables):
-        result = self.gql_client.execute(gql, variables=variables, headers=self.headers)
-        content = result
-        self.log_gql_execution(gql)
-        return content
+        def request():
+            return self.transport.post(self.api_endpoint, {'query': gql, 'variables': variables}, self.headers)
+
+        def execute():
+            # Timed from the caller's side, so waiting on the rate limit and
+            # retries count too.
+            start = time.perf_counter()
+            r = self.scheduler.submit(request, self.priority)
+            shared_metrics().observe('upstream', time.perf_counter() - start, len(r.content))
+            if r.status_code != 200:
+                raise ValueError(f'Received {r.status_code} status code from {self.api_endpoint}')
+            self.log_gql_execution(gql)
+            return r.json()
+
+        # Identical queries already in flight (e.g. everyone opening the same
+        # bracket as its cache entry expires) share one upstream call. Only
+        # at the same priority, a viewer shouldn't wait for a background
+        # request's turn at the rate limit.
+        key = (self.api_endpoint, self.priority, gql, json.dumps(variables, sort_keys=True))
+        return _in_flight.do(key, execute)
 
 
     def _execute_rest(self, url):
-        r = requests.get(url, headers=self.headers)
+        # Through the scheduler as well, so it's rate limited, retried and
+        # counted the same as GraphQL calls.
+        start = time.perf_counter()
+        r = self.scheduler.submit(lambda: self.transport.get(url, self.headers), self.priority)
+        shared_metrics().observe('upstream', time.perf_counter() - start, len(r.content))
         if r.status_code != 200:
             raise ValueError(f'Received {r.status_code} status code from {url}')
         return json.loads(r.text)
 
 
+    def _cached(self, query):
+        if query.final is not None:
+            response = self.archive.get('query', self.archive.key(query.gql, query.variables))
+            if response is not None:
+                return response
+        if query.entity is not None:
+            return self.models.get(*query.entity)
+        return None
+
+
+    def _store(self, query, response):
+        # Nothing is kept from a response with errors, it may be partial.
+        if response.get('errors') or not response.get('data'):
+            return
+        if query.final is not None and query.final(response):
+            self.archive.put('query', self.archive.key(query.gql, query.variables), response)
+        if query.entity is not None:
+            self.models.set(*query.entity, response)
+
+
+    def _missing_request(self, queries, responses):
+        # Queries with nothing cached are sent together as one request, and
+        # queries asking for the same thing (e.g. two views of one entity)
+        # are only sent once.
+        missing = {}
+        for query, response in zip(queries, responses):
+            if response is None:
+                missing.setdefault(_request_key(query), query)
+        missing = list(missing.values())
+        if len(missing) == 1:
+            return missing, missing[0]
+        return missing, compose_queries(missing)
+
+
+    def _fill(self, queries, responses, missing, response):
+        if len(missing) == 1:
+            parts = [(missing[0], response)]
+        else:
+            parts = list(split_composed(missing, response))
+        fetched = {}
+        for query, part in parts:
+            self._store(query, part)
+            fetched[_request_key(query)] = part
+        return [fetched[_request_key(query)] if response is None else response
+                for query, response in zip(queries, responses)]
+
+
+    def _responses(self, queries):
+        responses = [self._cached(query) for query in queries]
+        if all(response is not None for response in responses):
+            return responses
+        missing, request = self._missing_request(queries, responses)
+        return self._fill(queries, responses, missing, self._execute_gql(request.gql, request.variables))
+
+
+    def fetch(self, *queries):
+        # Runs several queries for the cost of at most one round trip, less
+        # whatever is already archived or in the model cache.
+        return [query.parse(response) for query, response in zip(queries, self._responses(queries))]
+
+
+    def _run(self, query):
+        return self.fetch(query)[0]
+
+
     def get_melee_tournaments(self, tournament_name):
+        tournaments = shared_tournament_index().search(tournament_name)
+        if tournaments is not None:
+            return self._indexed_tournaments(tournaments)
+        return self._run(self.melee_tournaments_query(tournament_name))
+
+
+    def _indexed_tournaments(self, tournaments):
+        return [tournament.Tournament(t['id'], t['name'], datetime.fromtimestamp(t['startAt'], pytz.timezone('Europe/Oslo')))
+                for t in tournaments]
+
+
+    def melee_tournaments_query(self, tournament_name):
         gql = \
             """
             query MeleeTournamentsByName($name: String!) {
@@ -75,31 +396,31 @@ class GGClient(object):
               }
             },
             """
-        r = self._execute_gql(gql, {'name': tournament_name})
-
-        tournaments = r['data']['tournaments']['nodes']
-        
-        filtered_tournaments = []
-        tournament_search = list(map(lambda name: name.lower(), tournament_name.split()))
-
-        for t in tournaments:
-          split_name = list(map(lambda name: "".join(filter(str.isalnum, name.lower())), t['name'].split()))
-          if all(elem in split_name for elem in tournament_search):
-            filtered_tournaments.append(t)
+        def parse(r):
+            # Everything start.gg found goes into the local index, which then
+            # answers the search. A full page may have left some out, so the
+            # index doesn't cover it and the page is filtered as is.
+            tournaments = r['data']['tournaments']['nodes']
+            index = shared_tournament_index()
+            index.add(tournaments, tournament_name if len(tournaments) < 500 else None)
+            found = index.search(tournament_name)
+            if found is None:
+                found = matching(tournaments, tournament_name)
+            return self._indexed_tournaments(found)
+        return GGQuery(gql, {'name': tournament_name}, parse, entity=('search', tournament_name.lower()))
 
-        tournaments_out = []
-        for t in filtered_tournaments:
-            id = t['id']
-            name = t['name']
-            date = datetime.fromtimestamp(t['startAt'], pytz.timezone('Europe/Oslo'))
-            tournaments_out.append(tournament.Tournament(id, name, date))
+    def _rest_tournament_search(self, tournament_url):
+        return self._parse_rest_tournament(self._execute_rest(tournament_url))
 
-        return tournaments_out
 
-    def _rest_tournament_search(self, tournament_url):
-        tournament_json = self._execute_rest(tournament_url)['entities']['tournament']
-        tournament = {tournament_json['id']: tournament_json['name']}
-        return tournament
+    def _parse_rest_tournament(self, r):
+        # A list of one, the same as the tournaments a search finds.
+        tournament_json = r['entities']['tournament']
+        return self._indexed_tournaments([{
+            'id': tournament_json['id'],
+            'name': tournament_json['name'],
+            'startAt': tournament_json.get('startAt') or 0,
+        }])
 
 
     def _parse_smashgg_tournament_url(self, original_url):
@@ -122,11 +443,19 @@ class GGClient(object):
             raise ValueError(f'Could not parse url: {url}')
 
 
-    def get_coming_tournaments(self):
+    def _coming_tournaments_url(self):
         api_url = 'https://smash.gg/api/-/gg_api./public/tournaments/schedule;'
         filter = 'filter=%7B%22upcoming%22%3Atrue%2C%22videogameIds%22%3A1%7D;'
-        r = self._execute_rest(f'{api_url}{filter}')
+        return f'{api_url}{filter}'
+
+
+    def get_coming_tournaments(self):
+        return self._parse_coming_tournaments(self._execute_rest(self._coming_tournaments_url()))
+
 
+    def _parse_coming_tournaments(self, r):
+        # Coming tournaments are worth finding by search too.
+        shared_tournament_index().add(r['items']['entities']['tournament'])
         tournaments = []
         for t in r['items']['entities']['tournament']:
             id = t['id']
@@ -147,11 +476,17 @@ class GGClient(object):
           return self.get_melee_tournaments(tournament_name)
 
     def get_melee_events(self, tournament_id):
+        return self._run(self.melee_events_query(tournament_id))
+
+
+    def _tournament_query(self, tournament_id, parse):
         gql = \
             """
             query tournament($profileId: ID!) {
               tournament(id: $profileId) {
                 name
+                slug
+                state
                 events {
                   id
                   name
@@ -162,25 +497,39 @@ class GGClient(object):
               }
             }
             """
-        response = self._execute_gql(gql, {'profileId': tournament_id})
-        melee_events = {}
-        for event in response['data']['tournament']['events']:
-            if event['videogame']['id'] == GGConstant.melee_type:
-                melee_events[event['id']] = event['name']
+        def final(response):
+            t = response['data']['tournament']
+            return t is not None and _is_completed(t['state'])
+        return GGQuery(gql, {'profileId': tournament_id}, parse, final, ('tournament', tournament_id))
+
+
+    def melee_events_query(self, tournament_id):
+        def parse(response):
+            melee_events = {}
+            for event in response['data']['tournament']['events']:
+                if event['videogame']['id'] == GGConstant.melee_type:
+                    melee_events[event['id']] = event['name']
 
 
-        if not melee_events:
-            tournament_name = response['data']['tournament']['name']
-            raise ValueError(f'Melee event not found for {tournament_name}') from None
-        return melee_events
+            if not melee_events:
+                tournament_name = response['data']['tournament']['name']
+                raise ValueError(f'Melee event not found for {tournament_name}') from None
+            return melee_events
+        return self._tournament_query(tournament_id, parse)
 
 
     def get_event_phases(self, event_id):
+        return self._run(self.event_phases_query(event_id))
+
+
+    def _event_query(self, event_id, parse):
         gql = \
             """
             query event($eventId: ID!) {
               event(id: $eventId) {
                 name
+                slug
+                state
                 phases {
                   id
                   name
@@ -191,17 +540,30 @@ class GGClient(object):
               }
             }
             """
-        result = self._execute_gql(gql, {'eventId': event_id})
-        phases = result['data']['event']['phases']
-        phase_ids = {p['id']: p['name'] for p in phases}
-        return phase_ids
+        def final(result):
+            event = result['data']['event']
+            return event is not None and _is_completed(event['state'])
+        return GGQuery(gql, {'eventId': event_id}, parse, final, ('event', event_id))
+
+
+    def event_phases_query(self, event_id):
+        def parse(result):
+            phases = result['data']['event']['phases']
+            phase_ids = {p['id']: p['name'] for p in phases}
+            return phase_ids
+        return self._event_query(event_id, parse)
 
 
     def get_phase_groups(self, phase_id):
+        return self._run(self.phase_groups_query(phase_id))
+
+
+    def phase_groups_query(self, phase_id):
         gql = \
             """
             query phase($phaseId: ID!) {
               phase(id: $phaseId) {
+                state
                 phaseGroups {
                   nodes {
                     id
@@ -229,137 +591,400 @@ class GGClient(object):
             'page': 1,
             'perPage': 999,
         }
-        result = self._execute_gql(gql, variables)
-        phase_groups = result['data']['phase']['phaseGroups']['nodes']
-        for phase_group in phase_groups:
-          if phase_group['wave']:
-            dateTime = datetime.fromtimestamp(phase_group['wave']['startAt'], pytz.timezone('Europe/Oslo'))
-            phase_group['wave']['startAt'] = (dateTime.strftime('%d-%m-%y, %H:%M, %Z'))
-        return phase_groups
+        def parse(result):
+            # Responses may be shared between coalesced callers, so build new
+            # dicts rather than formatting the dates in place.
+            phase_groups = []
+            for phase_group in result['data']['phase']['phaseGroups']['nodes']:
+              if phase_group['wave']:
+                dateTime = datetime.fromtimestamp(phase_group['wave']['startAt'], pytz.timezone('Europe/Oslo'))
+                wave = dict(phase_group['wave'], startAt=dateTime.strftime('%d-%m-%y, %H:%M, %Z'))
+                phase_group = dict(phase_group, wave=wave)
+              phase_groups.append(phase_group)
+            return phase_groups
 
+        def final(result):
+            return _is_completed(result['data']['phase']['state'])
+        return GGQuery(gql, variables, parse, final, ('phase', phase_id))
 
-    def get_phase_group_bracket(self, phase_group_id, tournament_id):
-        page_num = 1
-        gql = \
-            """
-            query bracket($phaseGroupId: ID!, $page: Int!, $perPage: Int!, $profileId: ID!) {
-              phaseGroup(id: $phaseGroupId) {
-                bracketType
-                phase {
-                  name
-                }
-                sets(page: $page, perPage: $perPage, sortType: STANDARD) {
-                  pageInfo {
-                    total
-                  }
-                  nodes {
-                    id
-                    round
-                    displayScore
-                    winnerId
-                    identifier
-                    wPlacement
-                    completedAt
-                    stream {
-                      streamName
-                      streamSource
-                    }
-                    slots {
-                      prereqId
-                      prereqType
-                      slotIndex
-                      entrant {
-                        id
-                        participants {
-                          id
-                          gamerTag
-                        }
-                        seeds {
-                          seedNum
-                          phaseGroup {
-                            id
-                          }
-                        }
-                      }
-                      standing {
-                        stats {
-                          score {
-                            value
-                          }
-                        }
-                      }
-                    }
-                  }
-                }
-              }
-              tournament(id: $profileId) {
-                name
-              }
-            }
-            """
+
+    def _bracket_set_objects(self):
+        # Every set in the bracket query returns the set and its stream, plus
+        # per slot: the slot, entrant, participant, standing, stats, score and
+        # a seed with its phase group for each phase the entrant played in.
+        # Assume a few phases so that brackets deep in an event still fit.
+        objects_per_slot = 6 + 2*GGConstant.assumed_seeds_per_entrant
+        return 2 + 2*objects_per_slot
+
+
+    def _bracket_sets_per_page(self):
+        return (GGConstant.complexity_limit - GGConstant.bracket_query_overhead) // self._bracket_set_objects()
+
+
+    def _is_complexity_error(self, result):
+        errors = result.get('errors') or []
+        return any('complexity' in error.get('message', '') for error in errors)
+
+
+    def _bracket_page_query(self, phase_group_id, tournament_id, page, per_page):
         variables = {
             'phaseGroupId': phase_group_id,
-            'page': page_num,
-            'perPage': 20,
+            'page': page,
+            'perPage': per_page,
             'profileId': tournament_id
         }
-        result = self._execute_gql(gql, variables)
+        return GGQuery(_bracket_page_gql, variables, lambda result: result)
+
+
+    def _bracket_page_count(self, result, per_page):
         phase_group = result['data']['phaseGroup']
-        page_result_num = phase_group['sets']['pageInfo']['total']
-
-        while page_result_num != 0:
-          page_num = page_num + 1
-          variables['page'] = page_num
-          next_result = self._execute_gql(gql, variables)
-      
-          phase_group['sets']['nodes'] += next_result['data']['phaseGroup']['sets']['nodes']
-          page_result_num = next_result['data']['phaseGroup']['sets']['pageInfo']['total']
-        
-
-        if phase_group['sets']['pageInfo']['total'] == 0:
+        page_info = phase_group['sets']['pageInfo']
+        if page_info['total'] == 0:
             raise ValueError(f'Bracket for "{phase_group["phase"]["name"]}" not started')
 
+        # Page 1 tells us exactly how many pages there are, so the rest can be
+        # fetched at once instead of walking until an empty page.
+        return self._page_count(result, per_page)
+
+
+    def _page_count(self, result, per_page):
+        page_info = result['data']['phaseGroup']['sets']['pageInfo']
+        return page_info.get('totalPages') or -(-page_info['total'] // per_page)
+
+
+    def _page_nodes(self, result):
+        return result['data']['phaseGroup']['sets']['nodes']
+
+
+    def _bracket_archive_key(self, phase_group_id, tournament_id):
+        query = self._bracket_page_query(phase_group_id, tournament_id, 1, self._bracket_sets_per_page())
+        return self.archive.key(query.gql, query.variables)
+
+
+    def _archived_bracket(self, phase_group_id, archive_key):
+        archived = self.archive.get('bracket', archive_key)
+        if archived is None:
+            return None
+        bracket = self._build_bracket(phase_group_id, archived['result'], archived['nodes'])
+        self._finalize(bracket)
+        return bracket
+
+
+    def _archive_if_completed(self, archive_key, result, nodes):
+        # A phase group start.gg calls completed never changes again. One
+        # whose sets so far are all played still may: scores get corrected
+        # and sets get added.
+        if _is_completed(result['data']['phaseGroup']['state']):
+            self.archive.put('bracket', archive_key, {'result': result, 'nodes': nodes})
+
+
+    def _cached_bracket(self, phase_group_id, archive_key):
+        bracket = self.models.get('phase_group', phase_group_id)
+        if bracket is None:
+            bracket = self._archived_bracket(phase_group_id, archive_key)
+        return bracket
+
+
+    def get_phase_group_bracket(self, phase_group_id, tournament_id):
+        return self.fetch_bracket(phase_group_id, tournament_id)[0]
+
+
+    def fetch_bracket(self, phase_group_id, tournament_id, *queries):
+        # Returns the finalized bracket, followed by the results of any extra
+        # queries. A bracket still in the model cache but past its ttl is
+        # patched with the sets updated since, rather than fetched again.
+        archive_key = self._bracket_archive_key(phase_group_id, tournament_id)
+        bracket = self._cached_bracket(phase_group_id, archive_key)
+        if bracket is None:
+            bracket = self.models.get_stale('phase_group', phase_group_id)
+            if bracket is not None and self.refresh_bracket(bracket):
+                self.models.set('phase_group', phase_group_id, bracket)
+            else:
+                bracket = None
+        if bracket is not None:
+            return [bracket, *self.fetch(*queries)]
+        return self._fetch_full_bracket(phase_group_id, tournament_id, archive_key, queries)
+
+
+    def _fetch_full_bracket(self, phase_group_id, tournament_id, archive_key, queries):
+        # Any extra queries not already cached ride along with the first page
+        # of sets, so a bracket page costs no more round trips than the
+        # bracket itself.
+        per_page = self._bracket_sets_per_page()
+        refreshed_at = int(time.time())
+        result, *responses = self._responses([self._bracket_page_query(phase_group_id, tournament_id, 1, per_page), *queries])
+        # The estimate can still be too generous (e.g. team entrants), so back
+        # off until start.gg accepts the page size.
+        while self._is_complexity_error(result) and per_page > 1:
+            per_page //= 2
+            result, *responses = self._responses([self._bracket_page_query(phase_group_id, tournament_id, 1, per_page), *queries])
+        results = [query.parse(response) for query, response in zip(queries, responses)]
+        bracket = self._complete_bracket(phase_group_id, tournament_id, archive_key, result, per_page, refreshed_at)
+        return [bracket, *results]
+
+
+    def _complete_bracket(self, phase_group_id, tournament_id, archive_key, result, per_page, refreshed_at):
+        # Fetches the pages after the first and builds, caches and, when it
+        # is finished, archives the bracket.
+        page_count = self._bracket_page_count(result, per_page)
+        remaining_pages = range(2, page_count + 1)
+
+        def fetch_page(page):
+            query = self._bracket_page_query(phase_group_id, tournament_id, page, per_page)
+            return self._page_nodes(self._run(query))
+
+        nodes = list(self._page_nodes(result))
+        if remaining_pages:
+            workers = min(GGConstant.max_page_workers, len(remaining_pages))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for page_nodes in pool.map(shared_metrics().in_context(fetch_page), remaining_pages):
+                    nodes += page_nodes
+
+        bracket = self._build_bracket(phase_group_id, result, nodes)
+        bracket.refreshed_at = refreshed_at
+        self._finalize(bracket)
+        self.models.set('phase_group', phase_group_id, bracket)
+        self._archive_if_completed(archive_key, result, nodes)
+        return bracket
+
+
+    def _estimated_sets(self, phase_group):
+        # How many sets a phase group will have, going by its seeds.
+        entrants = len(phase_group['seeds']['nodes'])
+        if phase_group['bracketType'] == 'ROUND_ROBIN':
+            return entrants*(entrants - 1) // 2
+        elif phase_group['bracketType'] == 'SINGLE_ELIMINATION':
+            return entrants
+        elif phase_group['bracketType'] == 'DOUBLE_ELIMINATION':
+            return 2*entrants
+        return self._bracket_sets_per_page()
+
+
+    def _bracket_batches(self, tournament_id, phase_groups):
+        # Packs the first page of every phase group into as few requests as
+        # the complexity limit allows. Each page asks for just the sets its
+        # phase group is expected to have, so many small pools fit in one.
+        objects_per_set = self._bracket_set_objects()
+        batches = []
+        for phase_group in sorted(phase_groups, key=self._estimated_sets, reverse=True):
+            per_page = max(1, min(self._estimated_sets(phase_group), self._bracket_sets_per_page()))
+            complexity = GGConstant.bracket_query_overhead + per_page*objects_per_set
+            query = self._bracket_page_query(phase_group['id'], tournament_id, 1, per_page)
+            for batch in batches:
+                if batch['complexity'] + complexity <= GGConstant.complexity_limit:
+                    break
+            else:
+                batch = {'complexity': 0, 'pages': []}
+                batches.append(batch)
+            batch['complexity'] += complexity
+            batch['pages'].append((phase_group['id'], per_page, query))
+        return [batch['pages'] for batch in batches]
+
+
+    def warm_brackets(self, tournament_id, phase_groups):
+        # Fetches the brackets of phase groups, as listed by
+        # phase_groups_query, that aren't cached yet, so clicking through
+        # the pools of a phase doesn't cost a fetch each. Anything start.gg
+        # refuses is left for fetch_bracket to deal with when it's viewed.
+        pending = [phase_group for phase_group in phase_groups
+                   if self.models.get_stale('phase_group', phase_group['id']) is None
+                   and self.archive.get('bracket', self._bracket_archive_key(phase_group['id'], tournament_id)) is None]
+
+        def fetch_batch(pages):
+            refreshed_at = int(time.time())
+            responses = self._responses([query for _, _, query in pages])
+            brackets = []
+            for (phase_group_id, per_page, _), result in zip(pages, responses):
+                if result.get('errors') or not (result.get('data') or {}).get('phaseGroup'):
+                    continue
+                archive_key = self._bracket_archive_key(phase_group_id, tournament_id)
+                try:
+                    if self._page_count(result, per_page) > 1:
+                        # More sets than the seeds let on, fetching it again
+                        # in full pages beats many pages of the guessed size.
+                        brackets.append(self._fetch_full_bracket(phase_group_id, tournament_id, archive_key, [])[0])
+                    else:
+                        brackets.append(self._complete_bracket(phase_group_id, tournament_id, archive_key,
+                                                               result, per_page, refreshed_at))
+                except ValueError:
+                    pass
+            return brackets
+
+        batches = self._bracket_batches(tournament_id, pending)
+        brackets = []
+        if batches:
+            workers = min(GGConstant.max_page_workers, len(batches))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for batch_brackets in pool.map(fetch_batch, batches):
+                    brackets += batch_brackets
+        return brackets
+
+
+    def _build_bracket(self, phase_group_id, result, nodes):
+        phase_group = result['data']['phaseGroup']
         bracket_name = phase_group['phase']['name']
         bracket_type = phase_group['bracketType']
         tournament_name = result['data']['tournament']['name']
         bracket = tournament.Bracket(phase_group_id, bracket_name, bracket_type, tournament_name)
 
-        for set in phase_group['sets']['nodes']:
-            stream = None
-            if set['stream']:
-              if 'streamSource' in set['stream']:
-                if set['stream']['streamSource'] == 'TWITCH':
-                  stream = 'https://twitch.tv/'+set['stream']['streamName']
-            set_params = {
-                'id': set['id'],
-                'phase': phase_group_id,
-                'round': set['round'],
-                'display_score': set['displayScore'],
-                'winner_id': set['winnerId'],
-                'identifier': set['identifier'],
-                'is_gf': set['wPlacement'] == 1,
-                'completed': set['completedAt'] is not None,
-                'slots': set['slots'],
-                'stream': stream
-            }
-            bracket.add_set(**set_params)
+        with shared_metrics().timer('build'):
+            for set in nodes:
+                bracket.add_set(**self._set_params(phase_group_id, set))
 
         return bracket
 
 
-    def get_user(self, user_id):
+    def _finalize(self, bracket):
+        with shared_metrics().timer('build'):
+            bracket.finalize()
+
+
+    def _set_params(self, phase_group_id, set):
+        stream = None
+        if set['stream']:
+          if 'streamSource' in set['stream']:
+            if set['stream']['streamSource'] == 'TWITCH':
+              stream = 'https://twitch.tv/'+set['stream']['streamName']
+        return {
+            'id': set['id'],
+            'phase': phase_group_id,
+            'round': set['round'],
+            'display_score': set['displayScore'],
+            'winner_id': set['winnerId'],
+            'identifier': set['identifier'],
+            'is_gf': set['wPlacement'] == 1,
+            'completed': set['completedAt'] is not None,
+            'slots': set['slots'],
+            'stream': stream
+        }
+
+
+    def _updated_sets_query(self, phase_group_id, updated_after, page, per_page):
+        variables = {
+            'phaseGroupId': phase_group_id,
+            'updatedAfter': updated_after,
+            'page': page,
+            'perPage': per_page,
+        }
+        return GGQuery(_updated_sets_gql, variables, lambda result: result)
+
+
+    def _patch_bracket(self, bracket, nodes, refreshed_at):
+        with shared_metrics().timer('build'):
+            for set in nodes:
+                if not bracket.update_set(**self._set_params(bracket.id, set)):
+                    return False
+        bracket.refreshed_at = refreshed_at
+        self._finalize(bracket)
+        return True
+
+
+    def refresh_bracket(self, bracket):
+        # Patches a bracket from an earlier fetch with only the sets start.gg
+        # reports as updated since then. Returns False if the bracket changed
+        # shape (e.g. it was reset) or start.gg turned the query down, and it
+        # has to be fetched in full instead. Brackets whose sets are all
+        # played are refreshed too, until start.gg calls them completed and
+        # they are archived; scores still get corrected.
+        refreshed_at = int(time.time())
+        updated_after = bracket.refreshed_at - GGConstant.refresh_margin
+        per_page = self._bracket_sets_per_page()
+
+        nodes = []
+        page_count = 1
+        page = 1
+        while page <= page_count:
+            result = self._run(self._updated_sets_query(bracket.id, updated_after, page, per_page))
+            if result.get('errors') or not (result.get('data') or {}).get('phaseGroup'):
+                return False
+            page_count = self._page_count(result, per_page)
+            nodes += self._page_nodes(result)
+            page += 1
+        return self._patch_bracket(bracket, nodes, refreshed_at)
+
+
+    def get_user(self, user_id, before=None, count=None):
+        # The newest count of a player's tournaments that started before the
+        # cursor, a startAt. Older pages are only fetched once asked for.
+        history = self.models.get('user', user_id)
+        if history is None:
+            history = self.models.get_stale('user', user_id) or self._new_user_history()
+            # Anything new since the last visit is on the first page.
+            self._merge_user_page(history, 1, self._run(self.user_query(user_id, 1)))
+            self.models.set('user', user_id, history)
+        while self._needs_older_page(history, before, count):
+            page = history['pages'] + 1
+            self._merge_user_page(history, page, self._run(self.user_query(user_id, page)))
+            self.models.set('user', user_id, history)
+        return self._user_page(history, before, count)
+
+
+    def _new_user_history(self):
+        # tournaments newest first, with starts their negated startAt for
+        # bisecting.
+        return {'id': None, 'gamerTag': None, 'tournaments': [], 'starts': [], 'pages': 0, 'total_pages': 1}
+
+
+    def _merge_user_page(self, history, page, result):
+        # Tournaments are merged by id, so pages shifted by tournaments added
+        # since the earlier ones were fetched don't cause duplicates.
+        participant = result['data']['participant']
+        connection = participant['user']['tournaments']
+        tournaments = {t['id']: t for t in history['tournaments']}
+        tournaments.update((t['id'], t) for t in connection['nodes'])
+        history['tournaments'] = sorted(tournaments.values(), key=lambda t: t['startAt'], reverse=True)
+        history['starts'] = [-t['startAt'] for t in history['tournaments']]
+        history['id'] = participant['id']
+        history['gamerTag'] = participant['gamerTag']
+        history['pages'] = max(history['pages'], page)
+        history['total_pages'] = connection['pageInfo']['totalPages'] or 1
+
+
+    def _user_page_bounds(self, history, before, count):
+        start = 0 if before is None else bisect.bisect_right(history['starts'], -before)
+        return start, start + (count or GGConstant.user_page_size)
+
+
+    def _needs_older_page(self, history, before, count):
+        _, end = self._user_page_bounds(history, before, count)
+        return end > len(history['tournaments']) and history['pages'] < history['total_pages']
+
+
+    def _user_page(self, history, before, count):
+        start, end = self._user_page_bounds(history, before, count)
+        # Don't split tournaments starting at the same time across pages,
+        # the cursor couldn't tell them apart.
+        while 0 < end < len(history['starts']) and history['starts'][end] == history['starts'][end - 1]:
+            end += 1
+        return {
+            'id': history['id'],
+            'gamerTag': history['gamerTag'],
+            'tournaments': history['tournaments'][start:end],
+            'starts': history['starts'][start:end],
+            'more': end < len(history['tournaments']) or history['pages'] < history['total_pages'],
+        }
+
+
+    def user_query(self, user_id, page):
         gql = \
             """
-            query user_tournaments($id: ID!) {
+            query user_tournaments($id: ID!, $page: Int!, $perPage: Int!) {
               participant(id: $id) {
                 id
-    						gamerTag
+                gamerTag
                 user {
                   tournaments (query: {
+                    page: $page
+                    perPage: $perPage
+                    sortBy: "startAt desc"
                     filter: {
                       videogameId: [1]
                     }
                   }) {
+                    pageInfo {
+                      total
+                      totalPages
+                    }
                     nodes {
                       id
                       name
@@ -371,54 +996,95 @@ class GGClient(object):
               }
             }
             """
-        r = self._execute_gql(gql, { 'id': user_id } )['data']['participant']
-        tournaments = r['user']['tournaments']['nodes']
-        tournaments.sort(key=lambda node: node['startAt'], reverse=True)
+        variables = {'id': user_id, 'page': page, 'perPage': GGConstant.user_tournaments_per_page}
+        return GGQuery(gql, variables, lambda result: result)
 
-        #for t in tournaments:
-        #  dateTime = datetime.fromtimestamp(t['startAt'], pytz.timezone('Europe/Oslo'))
-        #  t['startAt'] = (dateTime.strftime('%d-%m-%y, %H:%M, %Z'))
+    def get_smashgg_url(self, tournament_id, event_id, phase_id, phase_group_id):
+      return self._run(self.smashgg_url_query(tournament_id, event_id, phase_id, phase_group_id))
 
 
-        user = {}
-        user['tournaments'] = tournaments
-        user['gamerTag'] = r['gamerTag']
-        user['id'] = r['id']
+    def smashgg_url_query(self, tournament_id, event_id, phase_id, phase_group_id):
+      # Built from the same tournament or event data as the pages listing
+      # events and phases, so it is usually already in the model cache.
+      def parse(response):
+        result = response['data']
 
+        url = 'smash.gg/'
 
-        print(user)
+        if result.get('event'):
+          url += result['event']['slug']
+          if phase_id != 0:
+            url += '/brackets/'+str(phase_id)
+            if phase_group_id != 0:
+              url += '/'+str(phase_group_id)
+        elif result.get('tournament'):
+          url += result['tournament']['slug']
 
+        return url
 
-        return user
+      if event_id == 0:
+        return self._tournament_query(tournament_id, parse)
+      return self._event_query(event_id, parse)
 
-    def get_smashgg_url(self, tournament_id, event_id, phase_id, phase_group_id):
-      gql = \
-            """
-            query urlComponents($profileId: ID!, $eventId: ID!) {
-              tournament(id: $profileId) {
-                slug
-              }
-              event(id: $eventId) {
-                slug
-              }
-            }
-            """
-      variables = {
-        'profileId': tournament_id,
-        'eventId': event_id,
-      }
-
-      result = self._execute_gql(gql, variables)['data']
-
-      url = 'smash.gg/'
-      
-      if result['event']:
-        url += result['event']['slug']
-        if phase_id != 0:
-          url += '/brackets/'+str(phase_id)
-          if phase_group_id != 0:
-            url += '/'+str(phase_group_id)
-      elif result['tournament']:
-        url += result['tournament']['slug']
-      
-      return url
+
+def _to_thread(fn, *args, **kwargs):
+    # asyncio takes a while to import and only the async client needs it, so
+    # it is imported here rather than when the app starts.
+    import asyncio
+    return asyncio.to_thread(fn, *args, **kwargs)
+
+
+class AsyncGGClient(object):
+    # GGClient's methods as coroutines, so an async view can await several
+    # upstream calls at once. Each runs the blocking client on a worker
+    # thread, since Flask gives every async view its own short-lived event
+    # loop and the shared transport and caches have to outlive it. Queries
+    # are still built with the blocking client's builders.
+    def __init__(self, *args, **kwargs):
+        self.client = GGClient(*args, **kwargs)
+
+
+    def __getattr__(self, name):
+        if name.endswith('_query'):
+            return getattr(self.client, name)
+        raise AttributeError(name)
+
+
+    async def fetch(self, *queries):
+        return await _to_thread(self.client.fetch, *queries)
+
+
+    async def fetch_bracket(self, phase_group_id, tournament_id, *queries):
+        return await _to_thread(self.client.fetch_bracket, phase_group_id, tournament_id, *queries)
+
+
+    async def get_phase_group_bracket(self, phase_group_id, tournament_id):
+        return await _to_thread(self.client.get_phase_group_bracket, phase_group_id, tournament_id)
+
+
+    async def search_for_tournaments(self, tournament_name):
+        return await _to_thread(self.client.search_for_tournaments, tournament_name)
+
+
+    async def get_coming_tournaments(self):
+        return await _to_thread(self.client.get_coming_tournaments)
+
+
+    async def get_melee_events(self, tournament_id):
+        return await _to_thread(self.client.get_melee_events, tournament_id)
+
+
+    async def get_event_phases(self, event_id):
+        return await _to_thread(self.client.get_event_phases, event_id)
+
+
+    async def get_phase_groups(self, phase_id):
+        return await _to_thread(self.client.get_phase_groups, phase_id)
+
+
+    async def get_user(self, user_id, before=None, count=None):
+        return await _to_thread(self.client.get_user, user_id, before, count)
+
+
+    async def get_smashgg_url(self, tournament_id, event_id, phase_id, phase_group_id):
+        return await _to_thread(self.client.get_smashgg_url, tournament_id, event_id, phase_id, phase_group_id)
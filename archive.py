@@ -0,0 +1,91 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+
+
+# Somewhere writable by default. That is only as lasting as the machine's
+# temporary directory: on Vercel each instance starts with an empty one, so
+# the archive saves upstream calls for as long as an instance lives, not
+# across deploys or cold starts. Point GG_ARCHIVE_PATH at persistent storage
+# where there is some.
+ARCHIVE_PATH = os.getenv('GG_ARCHIVE_PATH', os.path.join(tempfile.gettempdir(), 'kneise-archive.db'))
+
+
+class Archive(object):
+    # Upstream responses for things that can no longer change (finished
+    # brackets, events and phases), kept on disk without expiry so they
+    # survive restarts, and deploys too where ARCHIVE_PATH is persistent.
+    # Entries are keyed on a hash of the query document, so changing a query
+    # simply stops matching old entries.
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.setup_database()
+
+
+    def get_db_connection(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = sqlite3.connect(self.path)
+        return self.local.conn
+
+
+    def setup_database(self):
+        try:
+            with self.get_db_connection() as conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS archive(
+                        kind TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        PRIMARY KEY(kind, key)
+                    )
+                    """
+                )
+        except sqlite3.Error as e:
+            # Read-only or missing storage just means nothing gets archived.
+            logging.getLogger(__name__).warning(f'Not archiving, {self.path} is not usable: {e}')
+            self.path = None
+
+
+    def key(self, gql, variables):
+        return hashlib.sha1((gql + json.dumps(variables, sort_keys=True)).encode()).hexdigest()
+
+
+    def get(self, kind, key):
+        if self.path is None:
+            return None
+        try:
+            row = self.get_db_connection().execute(
+                'SELECT payload FROM archive WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        except sqlite3.Error:
+            return None
+        return json.loads(row[0]) if row else None
+
+
+    def put(self, kind, key, payload):
+        if self.path is None:
+            return
+        try:
+            with self.get_db_connection() as conn:
+                conn.execute('INSERT OR REPLACE INTO archive(kind, key, payload) VALUES(?, ?, ?)',
+                             (kind, key, json.dumps(payload)))
+        except sqlite3.Error:
+            pass
+
+
+_shared_archive = None
+_shared_archive_lock = threading.Lock()
+
+
+def shared_archive():
+    global _shared_archive
+    if _shared_archive is None:
+        with _shared_archive_lock:
+            if _shared_archive is None:
+                _shared_archive = Archive(ARCHIVE_PATH)
+    return _shared_archive
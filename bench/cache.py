@@ -0,0 +1,101 @@
+# Hit rate and lookup latency of the cache backends selectable through
+# GG_CACHE_TYPE, with several worker processes sharing one keyspace the way
+# gunicorn workers serve the same brackets. Every miss stands in for an
+# upstream fetch: it sleeps for --fetch-delay and stores the payload.
+#
+#   python -m bench.cache [--backends simple,filesystem,redis] [--workers 4] [--requests 400]
+#
+# With the defaults, 'simple' hits about 88% and 'filesystem' about 96%.
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from flask import Flask
+from flask_caching import Cache
+from caching import cache_config
+
+
+def make_cache(backend, cache_dir):
+    config = cache_config(backend)
+    if backend == 'filesystem':
+        config['CACHE_DIR'] = cache_dir
+    return Cache(Flask(__name__), config=config)
+
+
+def worker(args):
+    backend, cache_dir, seed, options = args
+    cache = make_cache(backend, cache_dir)
+    rng = random.Random(seed)
+    keys = [f'bench:bracket:{i}' for i in range(options['keys'])]
+    # A few popular brackets and a long tail, like a weekend of majors.
+    weights = [1 / (i + 1) for i in range(len(keys))]
+    payload = os.urandom(options['payload'])
+
+    hits = 0
+    latencies = []
+    for key in rng.choices(keys, weights, k=options['requests']):
+        start = time.perf_counter()
+        value = cache.get(key)
+        latencies.append(time.perf_counter() - start)
+        if value is not None:
+            hits += 1
+        else:
+            time.sleep(options['fetch_delay'])
+            cache.set(key, payload, timeout=600)
+    return hits, latencies
+
+
+def run(backend, options):
+    cache_dir = tempfile.mkdtemp(prefix='kneise-bench-')
+    try:
+        try:
+            make_cache(backend, cache_dir).clear()
+        except Exception as e:
+            print(f'{backend:<12} skipped ({e.__class__.__name__}: {e})')
+            return
+
+        jobs = [(backend, cache_dir, seed, options) for seed in range(options['workers'])]
+        start = time.perf_counter()
+        with multiprocessing.Pool(options['workers']) as pool:
+            results = pool.map(worker, jobs)
+        wall = time.perf_counter() - start
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    hits = sum(h for h, _ in results)
+    latencies = sorted(l for _, ls in results for l in ls)
+    total = len(latencies)
+    p95 = latencies[int(total * 0.95) - 1]
+    print(f'{backend:<12} hit rate {hits/total:6.1%}  upstream fetches {total - hits:5}  '
+          f'get p50 {statistics.median(latencies)*1000:7.3f} ms  p95 {p95*1000:7.3f} ms  wall {wall:6.2f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', default='simple,filesystem,redis')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=400, help='lookups per worker')
+    parser.add_argument('--keys', type=int, default=50)
+    parser.add_argument('--payload', type=int, default=100_000, help='bytes per cached value')
+    parser.add_argument('--fetch-delay', type=float, default=0.05,
+                        help='simulated upstream fetch per miss, in seconds')
+    args = parser.parse_args()
+
+    options = {
+        'workers': args.workers,
+        'requests': args.requests,
+        'keys': args.keys,
+        'payload': args.payload,
+        'fetch_delay': args.fetch_delay,
+    }
+    for backend in args.backends.split(','):
+        run(backend, options)
+
+
+if __name__ == '__main__':
+    main()
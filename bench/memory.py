@@ -0,0 +1,65 @@
+# Memory held by a finalized bracket model, and how large it is once pickled
+# for the model cache, for synthetic 1024-entrant brackets.
+#
+#   python -m bench.memory [--entrants 1024] [--pool-entrants 32]
+import argparse
+import gc
+import os
+import pickle
+import time
+import tracemalloc
+from collections import Counter
+
+os.environ.setdefault('SMASHGG_API_KEY', 'bench')
+
+import tournament
+from GGClient import GGClient
+from bench.synth import SyntheticPhaseGroup
+
+
+MODEL_TYPES = (tournament.Set, tournament.Slot, tournament.Entrant, tournament.Prereq)
+
+
+def build(client, phase_group):
+    bracket = client._build_bracket(phase_group.id, phase_group.result(), phase_group.sets)
+    bracket.finalize()
+    return bracket
+
+
+def measure(client, name, phase_group):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    bracket = build(client, phase_group)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    objects = Counter(type(o).__name__ for o in gc.get_objects() if isinstance(o, MODEL_TYPES))
+    pickled = len(pickle.dumps(bracket, pickle.HIGHEST_PROTOCOL))
+    counts = '  '.join(f'{t.__name__} {objects[t.__name__]}' for t in MODEL_TYPES)
+    counts += f'  set table {bracket.set_table().nbytes/1024:.1f} KiB'
+    print(f'{name:<28} {len(bracket.sets):5} sets  held {held/1024:8.1f} KiB  peak {peak/1024:8.1f} KiB  '
+          f'pickled {pickled/1024:8.1f} KiB  build {elapsed*1000:7.1f} ms')
+    print(f'{"":<28} {counts}')
+    del bracket
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entrants', type=int, default=1024)
+    parser.add_argument('--pool-entrants', type=int, default=32)
+    args = parser.parse_args()
+
+    # Made up front, the client imports its HTTP stack when it is created and
+    # pools import NumPy when they are finalized.
+    client = GGClient()
+    import numpy
+    measure(client, f'double elimination ({args.entrants})', SyntheticPhaseGroup(1, args.entrants))
+    measure(client, f'single elimination ({args.entrants})', SyntheticPhaseGroup(2, args.entrants, 'SINGLE_ELIMINATION'))
+    measure(client, f'round robin ({args.pool_entrants})', SyntheticPhaseGroup(3, args.pool_entrants, 'ROUND_ROBIN'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# Time spent on each stage of serving a bracket, for synthetic phase groups
+# from 8 to 2048 entrants: fetching every page from a local stand-in for
+# api.start.gg, building the model with Bracket.add_set, Bracket.finalize,
+# and rendering bracket.jinja2 or pool.jinja2 with nothing cached. Round
+# robin pools stop at --pool-sizes, a 2048 entrant pool would be two million
+# sets.
+#
+# With --record, the medians are appended to a JSON lines file along with the
+# commit they were measured at, and compared with the previous run there.
+#
+#   python -m bench.pipeline [--sizes 8,32,128,512,2048] [--pool-sizes 4,8,16,32,64]
+#                            [--repeat 5] [--completed 0.5] [--record bench/pipeline.jsonl]
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+os.environ.setdefault('SMASHGG_API_KEY', 'bench')
+os.environ.setdefault('GG_RATE_LIMIT', '1000000')
+os.environ.setdefault('GG_CACHE_TYPE', 'simple')
+os.environ.setdefault('GG_ARCHIVE_PATH', os.path.join(tempfile.mkdtemp(prefix='kneise-bench-'), 'archive.db'))
+
+from flask import render_template
+from GGClient import GGClient
+from caching import LocalCache, ModelCache
+from index import app
+from tournament import BracketType
+from bench.standin import StandinServer
+from bench.synth import SyntheticPhaseGroup, responder
+
+
+STAGES = ['fetch', 'add_set', 'finalize', 'render']
+
+
+def fetch_nodes(client, phase_group_id):
+    # Every page of sets, the way fetch_bracket asks for them.
+    per_page = client._bracket_sets_per_page()
+    result = client._run(client._bracket_page_query(phase_group_id, 1, 1, per_page))
+    nodes = list(client._page_nodes(result))
+    for page in range(2, client._bracket_page_count(result, per_page) + 1):
+        nodes += client._page_nodes(client._run(client._bracket_page_query(phase_group_id, 1, page, per_page)))
+    return result, nodes
+
+
+def render(bracket):
+    with app.test_request_context():
+        if bracket.type == BracketType.ROUND_ROBIN:
+            return render_template('pool.jinja2', bracket=bracket, smashggurl='')
+        rounds = {round: render_template('bracket_round.jinja2', boxes=boxes, sets=bracket.sets)
+                  for round, boxes in bracket.layout.round_boxes.items()}
+        return render_template('bracket.jinja2', bracket=bracket, rounds=rounds, smashggurl='')
+
+
+def run_case(client, phase_group, repeat):
+    timings = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        client.models = ModelCache(LocalCache())
+
+        start = time.perf_counter()
+        result, nodes = fetch_nodes(client, phase_group.id)
+        timings['fetch'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        bracket = client._build_bracket(phase_group.id, result, nodes)
+        timings['add_set'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        bracket.finalize()
+        timings['finalize'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        render(bracket)
+        timings['render'].append(time.perf_counter() - start)
+    return {stage: statistics.median(samples)*1000 for stage, samples in timings.items()}, len(nodes)
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_run(path):
+    try:
+        with open(path) as f:
+            lines = [line for line in f if line.strip()]
+    except FileNotFoundError:
+        return None
+    return json.loads(lines[-1]) if lines else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='8,32,128,512,2048', help='elimination bracket entrants')
+    parser.add_argument('--pool-sizes', default='4,8,16,32,64', help='round robin pool entrants')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--completed', type=float, default=0.5, help='fraction of sets played')
+    parser.add_argument('--record', help='JSON lines file to append the results to')
+    args = parser.parse_args()
+
+    cases = []
+    phase_group_id = 1
+    for bracket_type, sizes in [('DOUBLE_ELIMINATION', args.sizes), ('SINGLE_ELIMINATION', args.sizes),
+                                ('ROUND_ROBIN', args.pool_sizes)]:
+        for entrants in map(int, sizes.split(',')):
+            name = f'{bracket_type.lower()} {entrants}'
+            cases.append((name, SyntheticPhaseGroup(phase_group_id, entrants, bracket_type, args.completed)))
+            phase_group_id += 1
+
+    previous = previous_run(args.record) if args.record else None
+    results = {}
+    with StandinServer(responder({phase_group.id: phase_group for _, phase_group in cases})) as server:
+        client = GGClient(api_endpoint=server.url)
+        # Pools import NumPy when they are finalized, imported here so the
+        # first round robin case doesn't time it.
+        import numpy
+        print(f'{"":<26} {"sets":>5} ' + ' '.join(f'{stage:>10}' for stage in STAGES))
+        for name, phase_group in cases:
+            timings, sets = run_case(client, phase_group, args.repeat)
+            results[name] = timings
+            line = f'{name:<26} {sets:5} ' + ' '.join(f'{timings[stage]:7.2f} ms' for stage in STAGES)
+            if previous and name in previous['results']:
+                before = previous['results'][name]
+                line += '  vs last: ' + ' '.join(f'{(timings[stage]/before[stage] - 1)*100:+4.0f}%'
+                                                 for stage in STAGES if before.get(stage))
+            print(line)
+
+    if args.record:
+        with open(args.record, 'a') as f:
+            f.write(json.dumps({
+                'time': int(time.time()),
+                'commit': commit(),
+                'python': platform.python_version(),
+                'repeat': args.repeat,
+                'completed': args.completed,
+                'results': results,
+            }) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    # Keep-alive only works with HTTP/1.1 and an explicit Content-Length.
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out as separate writes; without this Nagle and
+    # delayed ACKs add ~40ms to every reused connection.
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # Stands in for the TCP and TLS handshakes against api.start.gg, which
+        # are paid once per connection rather than once per request.
+        time.sleep(self.server.connect_delay)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def _respond(self, body):
+        time.sleep(self.server.request_delay)
+        payload = json.dumps(body).encode()
+        self.server.requests_served += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        self._respond(self.server.responder(request))
+
+
+    def do_GET(self):
+        self._respond(self.server.responder({'path': self.path}))
+
+
+class StandinServer(object):
+    def __init__(self, responder=None, connect_delay=0.0, request_delay=0.0):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), StandinHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.responder = responder or (lambda request: {'data': {}})
+        self.httpd.connect_delay = connect_delay
+        self.httpd.request_delay = request_delay
+        self.httpd.requests_served = 0
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f'http://{host}:{port}/gql/alpha'
+
+
+    @property
+    def requests_served(self):
+        return self.httpd.requests_served
+
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,79 @@
+# Import time of the app in fresh interpreters, which is most of a cold start
+# on Vercel. Exits with status 1 when the median goes over --budget, so it
+# can gate a deploy.
+#
+#   python -m bench.startup [--runs 5] [--budget 400] [--top 10]
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_times():
+    # The cumulative import time of index, and of the modules it imports
+    # directly or one level down, in ms, from python -X importtime.
+    env = dict(os.environ, SMASHGG_API_KEY=os.getenv('SMASHGG_API_KEY', 'bench'))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import index'],
+                            env=env, capture_output=True, text=True, check=True)
+    # Modules are listed after everything they import, so the modules index
+    # imports are the ones listed since the previous top-level import.
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match is None:
+            continue
+        name, cumulative, depth = match.group(4), int(match.group(2)) / 1000, len(match.group(3))
+        if depth == 1 and name == 'index':
+            return cumulative, modules
+        elif depth == 1:
+            modules = {}
+        elif depth <= 5:
+            modules[name] = cumulative
+    raise ValueError('index was not imported')
+
+
+def budget():
+    return float(os.getenv('GG_STARTUP_BUDGET', 400))
+
+
+def measure(runs):
+    # The import time of index in each run, and of the modules under it.
+    totals = []
+    modules = defaultdict(list)
+    for _ in range(runs):
+        total, times = import_times()
+        totals.append(total)
+        for name, cumulative in times.items():
+            modules[name].append(cumulative)
+    return totals, modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=budget(),
+                        help='maximum median import time of index, in ms')
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list')
+    args = parser.parse_args()
+
+    totals, modules = measure(args.runs)
+    median = statistics.median(totals)
+    print(f'import index  median {median:7.1f} ms  min {min(totals):7.1f} ms  max {max(totals):7.1f} ms  '
+          f'budget {args.budget:.0f} ms')
+    slowest = sorted(modules.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, samples in slowest[:args.top]:
+        print(f'  {name:<40} {statistics.median(samples):7.1f} ms')
+
+    if median > args.budget:
+        print(f'over budget by {median - args.budget:.1f} ms')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
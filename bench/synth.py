@@ -0,0 +1,175 @@
+# Synthetic phase groups shaped like start.gg's responses to the bracket query,
+# for benchmarking without hitting the API, directly or through a stand-in
+# server. Higher seeds always win, and only the first `completed` fraction of
+# the sets have been played. Elimination brackets need a power of two
+# entrants.
+import string
+
+
+def identifier(i):
+    # A, B, ..., Z, AA, AB, ... like start.gg's set identifiers.
+    s = ''
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        s = string.ascii_uppercase[r] + s
+    return s
+
+
+def seed_order(n):
+    # Bracket positions for seeds 1..n, so that 1 and 2 meet last.
+    order = [1]
+    while len(order) < n:
+        m = len(order)*2
+        order = [x for s in order for x in (s, m + 1 - s)]
+    return order
+
+
+class SyntheticPhaseGroup(object):
+    def __init__(self, id, entrants, type='DOUBLE_ELIMINATION', completed=1.0):
+        self.id = id
+        self.type = type
+        self.completed = completed
+        self.entrants = {seed: self._entrant(seed) for seed in range(1, entrants + 1)}
+        self.sets = []
+        self.next_set_id = id*10000
+        if type == 'ROUND_ROBIN':
+            self.expected_sets = entrants*(entrants - 1) // 2
+            self._build_round_robin()
+        elif type == 'SINGLE_ELIMINATION':
+            self.expected_sets = entrants - 1
+            self._build_elimination(grand_final=True)
+        else:
+            self.expected_sets = 2*entrants - 1
+            self._build_double_elimination()
+
+
+    def _entrant(self, seed):
+        return {
+            'id': 1000 + seed,
+            'participants': [{'id': 5000 + seed, 'gamerTag': f'Player {seed}'}],
+            'seeds': [{'seedNum': seed, 'phaseGroup': {'id': self.id}}],
+        }
+
+
+    def _add_set(self, round, feeders, w_placement=None):
+        # feeders are (prereq type, prereq id, placement, entrant or None).
+        id = self.next_set_id
+        self.next_set_id += 1
+        slots = []
+        for i, (prereq_type, prereq_id, placement, entrant) in enumerate(feeders):
+            slots.append({
+                'prereqId': str(prereq_id),
+                'prereqType': prereq_type,
+                'prereqPlacement': placement,
+                'slotIndex': i,
+                'entrant': entrant,
+                'standing': None,
+            })
+        set = {
+            'id': id,
+            'round': round,
+            'displayScore': None,
+            'winnerId': None,
+            'identifier': identifier(len(self.sets)),
+            'wPlacement': w_placement or 99,
+            'completedAt': None,
+            'updatedAt': 1,
+            'stream': None,
+            'slots': slots,
+        }
+
+        winner = loser = None
+        entrants = [entrant for _, _, _, entrant in feeders]
+        if all(entrants) and len(self.sets) < self.completed*self.expected_sets:
+            winner, loser = sorted(entrants, key=lambda e: e['seeds'][0]['seedNum'])
+            set['winnerId'] = winner['id']
+            set['completedAt'] = 100 + len(self.sets)
+            set['displayScore'] = f"{winner['participants'][0]['gamerTag']} 3 - {loser['participants'][0]['gamerTag']} 1"
+            for slot in slots:
+                slot['standing'] = {'stats': {'score': {'value': 3 if slot['entrant'] is winner else 1}}}
+        self.sets.append(set)
+        return id, winner, loser
+
+
+    def _build_elimination(self, grand_final):
+        feeders = [('seed', seed, None, self.entrants[seed]) for seed in seed_order(len(self.entrants))]
+        losers = []
+        round = 1
+        while len(feeders) > 1:
+            next_feeders = []
+            round_losers = []
+            for i in range(0, len(feeders), 2):
+                w_placement = 1 if grand_final and len(feeders) == 2 else None
+                id, winner, loser = self._add_set(round, feeders[i:i + 2], w_placement)
+                next_feeders.append(('set', id, 1, winner))
+                round_losers.append(('set', id, 2, loser))
+            losers.append(round_losers)
+            feeders = next_feeders
+            round += 1
+        return feeders[0], losers, round
+
+
+    def _build_double_elimination(self):
+        winners_final, losers, grand_final_round = self._build_elimination(grand_final=False)
+        round = -1
+        feeders = []
+        for i in range(0, len(losers[0]), 2):
+            id, winner, _ = self._add_set(round, losers[0][i:i + 2])
+            feeders.append(('set', id, 1, winner))
+        round -= 1
+        for dropping in losers[1:]:
+            # Losers coming down from the upper bracket meet the survivors,
+            # then the survivors play each other until the sides match again.
+            next_feeders = []
+            for survivor, dropped in zip(feeders, reversed(dropping)):
+                id, winner, _ = self._add_set(round, [survivor, dropped])
+                next_feeders.append(('set', id, 1, winner))
+            feeders = next_feeders
+            round -= 1
+            if len(feeders) > 1:
+                next_feeders = []
+                for i in range(0, len(feeders), 2):
+                    id, winner, _ = self._add_set(round, feeders[i:i + 2])
+                    next_feeders.append(('set', id, 1, winner))
+                feeders = next_feeders
+                round -= 1
+        self._add_set(grand_final_round, [winners_final, feeders[0]], w_placement=1)
+
+
+    def _build_round_robin(self):
+        # The circle method, with a bye for odd pools.
+        seeds = list(self.entrants) + ([None] if len(self.entrants) % 2 else [])
+        for round in range(1, len(seeds)):
+            for i in range(len(seeds) // 2):
+                a, b = seeds[i], seeds[-1 - i]
+                if a and b:
+                    self._add_set(round, [('seed', a, None, self.entrants[a]), ('seed', b, None, self.entrants[b])])
+            seeds = [seeds[0], seeds[-1]] + seeds[1:-1]
+
+
+    def result(self, page=1, per_page=None):
+        # A page of the bracket query, by default page one without the sets.
+        nodes = []
+        total_pages = 1
+        if per_page:
+            nodes = self.sets[(page - 1)*per_page:page*per_page]
+            total_pages = -(-len(self.sets) // per_page)
+        return {'data': {
+            'phaseGroup': {
+                'bracketType': self.type,
+                'state': 3 if all(set['completedAt'] for set in self.sets) else 2,
+                'phase': {'name': 'Bracket'},
+                'sets': {'pageInfo': {'total': len(self.sets), 'totalPages': total_pages}, 'nodes': nodes},
+            },
+            'tournament': {'name': 'Synthetic'},
+        }}
+
+
+def responder(phase_groups):
+    # Answers the bracket query for a stand-in server, from phase groups by id.
+    def respond(request):
+        variables = request.get('variables') or {}
+        phase_group = phase_groups[variables['phaseGroupId']]
+        return phase_group.result(variables['page'], variables['perPage'])
+    return respond
@@ -0,0 +1,78 @@
+# Per-request upstream latency of GGClient against a local stand-in for
+# api.start.gg, comparing a fresh connection per request (how the client used
+# to work) with the shared keep-alive transport.
+#
+#   python -m bench.transport [--requests 200] [--threads 8] [--connect-delay 0.02]
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('SMASHGG_API_KEY', 'bench')
+
+import requests
+from GGClient import GGClient
+from transport import Transport
+from bench.standin import StandinServer
+
+
+GQL = 'query tournament($profileId: ID!) { tournament(id: $profileId) { name } }'
+
+
+def fresh_connection_call(url, headers):
+    r = requests.post(url, json={'query': GQL, 'variables': {'profileId': 1}}, headers=headers)
+    r.raise_for_status()
+    return r.json()
+
+
+def pooled_call(client):
+    return client._execute_gql(GQL, {'profileId': 1})
+
+
+def timed(fn, n, threads):
+    def one(_):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        start = time.perf_counter()
+        latencies = list(pool.map(one, range(n)))
+        wall = time.perf_counter() - start
+    return latencies, wall
+
+
+def report(name, latencies, wall, served):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f'{name:<18} mean {statistics.mean(latencies)*1000:7.2f} ms  '
+          f'p50 {statistics.median(latencies)*1000:7.2f} ms  '
+          f'p95 {p95*1000:7.2f} ms  wall {wall:6.2f} s  ({served} upstream requests)')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--connect-delay', type=float, default=0.02,
+                        help='simulated handshake cost per new connection, in seconds')
+    parser.add_argument('--request-delay', type=float, default=0.005)
+    args = parser.parse_args()
+
+    responder = lambda request: {'data': {'tournament': {'name': 'Bench'}}}
+    for name in ['fresh connection', 'pooled transport']:
+        with StandinServer(responder, args.connect_delay, args.request_delay) as server:
+            if name == 'fresh connection':
+                headers = GGClient(api_endpoint=server.url).headers
+                fn = lambda: fresh_connection_call(server.url, headers)
+            else:
+                transport = Transport(pool_size=args.threads)
+                client = GGClient(api_endpoint=server.url, transport=transport)
+                fn = lambda: pooled_call(client)
+            latencies, wall = timed(fn, args.requests, args.threads)
+            report(name, latencies, wall, server.requests_served)
+
+
+if __name__ == '__main__':
+    main()
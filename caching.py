@@ -0,0 +1,197 @@
+import functools
+import os
+import pickle
+import tempfile
+import threading
+import time
+from flask import copy_current_request_context, current_app, request
+
+
+def cache_config(cache_type=None):
+    # Flask-Caching config for GG_CACHE_TYPE: 'uwsgi' (the default under
+    # uWSGI), 'filesystem' (the default otherwise, shared by every worker on
+    # the host), 'redis' (shared between hosts, needs the redis package) or
+    # 'simple' (per process).
+    cache_type = cache_type or os.getenv('GG_CACHE_TYPE')
+    if cache_type is None:
+        try:
+            import uwsgi
+            cache_type = 'uwsgi'
+        except ImportError:
+            cache_type = 'filesystem'
+
+    if cache_type == 'uwsgi':
+        return {'CACHE_TYPE': 'uwsgi', 'CACHE_UWSGI_NAME': 'smashggcache', 'CACHE_DEFAULT_TIMEOUT': 60}
+    elif cache_type == 'filesystem':
+        return {
+            'CACHE_TYPE': 'filesystem',
+            'CACHE_DIR': os.getenv('GG_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'kneise-cache')),
+            'CACHE_THRESHOLD': int(os.getenv('GG_CACHE_THRESHOLD', 2000)),
+        }
+    elif cache_type == 'redis':
+        return {
+            'CACHE_TYPE': 'redis',
+            'CACHE_REDIS_URL': os.getenv('GG_CACHE_REDIS_URL', 'redis://localhost:6379/0'),
+            'CACHE_KEY_PREFIX': 'kneise:',
+        }
+    elif cache_type == 'simple':
+        return {'CACHE_TYPE': 'simple'}
+    raise ValueError(f'Unknown GG_CACHE_TYPE: {cache_type}')
+
+
+def template_bytecode_cache():
+    # Compiled templates on disk, so a new worker or a cold start on the same
+    # host loads them instead of compiling every template again.
+    from jinja2 import FileSystemBytecodeCache
+    directory = os.getenv('GG_TEMPLATE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'kneise-templates'))
+    os.makedirs(directory, exist_ok=True)
+    return FileSystemBytecodeCache(directory)
+
+
+def stale_while_revalidate(cache, soft_timeout, hard_timeout):
+    # Like cache.memoize, but an entry older than soft_timeout is still served
+    # while one background thread renders a fresh copy. Requests only wait on
+    # the view when there is nothing cached, or it is older than hard_timeout.
+    # The view may be a coroutine function.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = f'swr:{view.__name__}:{request.path}'
+
+            def render():
+                value = current_app.ensure_sync(view)(*args, **kwargs)
+                cache.set(key, (value, time.time()), timeout=hard_timeout)
+                return value
+
+            entry = cache.get(key)
+            if entry is None:
+                return render()
+
+            value, rendered_at = entry
+            if time.time() - rendered_at > soft_timeout and cache.add(f'{key}:refreshing', True, timeout=soft_timeout):
+                @copy_current_request_context
+                def refresh():
+                    try:
+                        render()
+                    except Exception:
+                        current_app.logger.exception(f'Background refresh of {request.path} failed')
+                    finally:
+                        cache.delete(f'{key}:refreshing')
+                threading.Thread(target=refresh, daemon=True).start()
+            return value
+        return wrapper
+    return decorator
+
+
+def cached_fragments(cache, prefix, digests, render, timeout=10*60):
+    # Renders the parts of a page named in digests, a name to content hash
+    # mapping, reusing whatever was rendered for the same content before.
+    keys = {name: f'fragment:{prefix}:{name}:{digest}' for name, digest in digests.items()}
+    fragments = dict(zip(keys, cache.get_many(*keys.values())))
+    rendered = {name: render(name) for name, fragment in fragments.items() if fragment is None}
+    if rendered:
+        cache.set_many({keys[name]: fragment for name, fragment in rendered.items()}, timeout=timeout)
+    fragments.update(rendered)
+    return fragments
+
+
+class LocalCache(object):
+    # A per-process stand-in for a Flask-Caching backend, for when the client
+    # runs outside the app. Values are pickled so callers always get their
+    # own copy and can modify it freely.
+    def __init__(self, threshold=500):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.entries = {}
+
+
+    def _prune(self, now):
+        expired = [key for key, (expires, _) in self.entries.items() if expires <= now]
+        for key in expired:
+            del self.entries[key]
+        while len(self.entries) >= self.threshold:
+            del self.entries[next(iter(self.entries))]
+
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return pickle.loads(entry[1])
+
+
+    def set(self, key, value, timeout=None):
+        now = time.time()
+        entry = (now + (timeout or 300), pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            if key not in self.entries and len(self.entries) >= self.threshold:
+                self._prune(now)
+            self.entries[key] = entry
+        return True
+
+
+    def delete(self, key):
+        with self.lock:
+            return self.entries.pop(key, None) is not None
+
+
+class ModelCache(object):
+    # Parsed upstream data keyed by entity (tournament, event, phase, phase
+    # group, ...), so pages further down the tournament tree reuse whatever
+    # the pages above them already fetched. Each kind is fresh for its own
+    # ttl; entries are kept for a while after that so a stale bracket can be
+    # patched instead of fetched again.
+    ttls = {
+        'tournament': 10*60,
+        'event': 10*60,
+        'phase': 10*60,
+        'phase_group': 60,
+        'user': 10*60,
+        'search': 10*60,
+    }
+    stale_timeout = 10*60
+
+    def __init__(self, backend):
+        self.backend = backend
+
+
+    def _key(self, kind, id):
+        return f'model:{kind}:{id}'
+
+
+    def get_stale(self, kind, id):
+        entry = self.backend.get(self._key(kind, id))
+        return entry[1] if entry is not None else None
+
+
+    def get(self, kind, id):
+        entry = self.backend.get(self._key(kind, id))
+        if entry is None or time.time() - entry[0] > self.ttls[kind]:
+            return None
+        return entry[1]
+
+
+    def set(self, kind, id, value):
+        self.backend.set(self._key(kind, id), (time.time(), value), timeout=self.ttls[kind] + self.stale_timeout)
+
+
+_shared_model_cache = None
+_shared_model_cache_lock = threading.Lock()
+
+
+def use_model_cache_backend(backend):
+    # Lets the app put models in the same (possibly cross-process) store as
+    # its rendered pages.
+    global _shared_model_cache
+    with _shared_model_cache_lock:
+        _shared_model_cache = ModelCache(backend)
+
+
+def shared_model_cache():
+    global _shared_model_cache
+    if _shared_model_cache is None:
+        with _shared_model_cache_lock:
+            if _shared_model_cache is None:
+                _shared_model_cache = ModelCache(LocalCache())
+    return _shared_model_cache
@@ -1,8 +1,18 @@
+import bisect
+import flask
+import hmac
+import json
 import logging
-from GGClient import GGClient
+import os
+import threading
+from GGClient import AsyncGGClient, GGClient
+from caching import cache_config, cached_fragments, stale_while_revalidate, template_bytecode_cache, use_model_cache_backend
+from metrics import shared_metrics
+from prefetch import shared_prefetcher
+from scheduler import Priority
 from tournament import BracketType
 from whomst.whomst_db import Whomst
-from flask import Flask, render_template, redirect, request, jsonify
+from flask import Flask, redirect, request, jsonify
 from flask.logging import create_logger
 from flask_caching import Cache
 from itertools import groupby
@@ -12,22 +22,61 @@ import time
 
 app = Flask(__name__)
 app.logger.setLevel(logging.INFO)
+app.jinja_env.bytecode_cache = template_bytecode_cache()
 
-try:
-    import uwsgi
-    cache_config = {'CACHE_TYPE': 'uwsgi', 'CACHE_UWSGI_NAME': 'smashggcache', 'CACHE_DEFAULT_TIMEOUT': 60}
-except ImportError:
-    cache_config = {'CACHE_TYPE': 'simple'}
-finally:
-    cache = Cache(app, config=cache_config)
-    cache.init_app(app)
+cache = Cache(app, config=cache_config())
+cache.init_app(app)
+use_model_cache_backend(cache.cache)
+
+# Threads that outlive a request only get to finish in a long-running
+# process. Vercel freezes an instance as soon as it has responded.
+background_threads = not os.getenv('VERCEL')
+
+# Opt in. Only one process per cache, see prefetch.py, prefetches at a time.
+if os.getenv('GG_PREFETCH', '0') == '1' and background_threads:
+    shared_prefetcher().start(cache)
 
 #whomster = Whomst('./whomst/')
 #whomster.setup_database()
 
 
+@app.before_request
+def start_timing():
+    shared_metrics().start_request()
+
+
+@app.after_request
+def add_server_timing(response):
+    # Where this request's time went, for the browser's dev tools.
+    timings = shared_metrics().end_request(request.endpoint)
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.server_timing()
+    return response
+
+
+def render_template(template_name, **context):
+    # flask.render_template, timed for Server-Timing and /metrics.
+    with shared_metrics().timer('render'):
+        return flask.render_template(template_name, **context)
+
+
+@app.route('/metrics')
+def metrics():
+    # This process only, each worker keeps its own. Only for scrapers with
+    # the bearer token in GG_METRICS_TOKEN, and not there at all without it.
+    token = os.getenv('GG_METRICS_TOKEN')
+    if not token:
+        flask.abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        flask.abort(401)
+    return app.response_class(shared_metrics().exposition(), mimetype='text/plain')
+
+
 @app.errorhandler(ValueError)
 def handle_value_error(error):
+    # Scripts polling the JSON API need to tell an error from a bracket.
+    if request.path.startswith('/api/'):
+        return jsonify({'error': str(error)}), 502
     return 'bee boo poo pee fucko boingo in the backend' + \
         f'<br><br>{str(error)}'
 
@@ -58,6 +107,7 @@ def coming_tournaments():
 
 
 @app.route('/bracket/search/<string:search>')
+@cache.memoize(timeout=10*60)
 def choose_tournament(search):
     search = unquote_plus(search)
     client = GGClient(logger=app.logger)
@@ -72,8 +122,9 @@ def choose_tournament(search):
 @cache.memoize(timeout=10*60)
 def choose_event(tournament_id):
     client = GGClient(logger=app.logger)
-    events = client.get_melee_events(tournament_id)
-    smashggurl = client.get_smashgg_url(tournament_id, 0, 0, 0)
+    events, smashggurl = client.fetch(
+        client.melee_events_query(tournament_id),
+        client.smashgg_url_query(tournament_id, 0, 0, 0))
 
     if len(events) == 1:
         event_id = list(events.keys())[0]
@@ -85,8 +136,9 @@ def choose_event(tournament_id):
 @cache.memoize(timeout=10*60)
 def choose_phase(tournament_id, event_id):
     client = GGClient(logger=app.logger)
-    phases = client.get_event_phases(event_id)
-    smashggurl = client.get_smashgg_url(tournament_id, event_id, 0, 0)
+    phases, smashggurl = client.fetch(
+        client.event_phases_query(event_id),
+        client.smashgg_url_query(tournament_id, event_id, 0, 0))
 
     if len(phases) == 1:
         phase_id = list(phases.keys())[0]
@@ -98,42 +150,141 @@ def choose_phase(tournament_id, event_id):
 @cache.memoize(timeout=10*60)
 def choose_phase_group(tournament_id, event_id, phase_id):
     client = GGClient(logger=app.logger)
-    phase_groups = client.get_phase_groups(phase_id)
-    smashggurl = client.get_smashgg_url(tournament_id, event_id, phase_id, 0)
+    phase_groups, smashggurl = client.fetch(
+        client.phase_groups_query(phase_id),
+        client.smashgg_url_query(tournament_id, event_id, phase_id, 0))
 
     if len(phase_groups) == 1:
         phase_group_id = phase_groups[0]['id']
         return redirect(f'{request.path}/{phase_group_id}')
+
+    # Fetch all the pools while the user picks one, a few to a request.
+    # GG_WARM_BRACKETS=0 turns it off.
+    if os.getenv('GG_WARM_BRACKETS', '1') == '1' and background_threads:
+        warm_client = GGClient(logger=app.logger, priority=Priority.BACKGROUND)
+        threading.Thread(target=warm_client.warm_brackets, args=(tournament_id, phase_groups), daemon=True).start()
     return render_template('phase_group.jinja2', url_path=request.path, phase_groups=phase_groups, smashggurl=smashggurl)
 
 
 @app.route('/bracket/<int:tournament_id>/<int:event_id>/<int:phase_id>/<int:phase_group_id>')
-@cache.memoize(timeout=1*60)
-def render_bracket(tournament_id, event_id, phase_id, phase_group_id):
-    client = GGClient(logger=app.logger)
-    bracket = client.get_phase_group_bracket(phase_group_id, tournament_id)
-    bracket.finalize()
-    smashggurl = client.get_smashgg_url(tournament_id, event_id, phase_id, phase_group_id)
+@stale_while_revalidate(cache, soft_timeout=1*60, hard_timeout=10*60)
+async def render_bracket(tournament_id, event_id, phase_id, phase_group_id):
+    client = AsyncGGClient(logger=app.logger)
+    bracket, smashggurl = await client.fetch_bracket(phase_group_id, tournament_id,
+        client.smashgg_url_query(tournament_id, event_id, phase_id, phase_group_id))
 
     if bracket.type in [BracketType.DOUBLE_ELIMINATION, BracketType.SINGLE_ELIMINATION]:
-        return render_template('bracket.jinja2', bracket=bracket, smashggurl=smashggurl)
+        # Only rounds that changed since they were last rendered are rendered
+        # again, the rest come from the cache.
+        def render_round(round):
+            return render_template('bracket_round.jinja2', boxes=bracket.layout.round_boxes[round], sets=bracket.sets)
+        rounds = cached_fragments(cache, f'bracket_round:{bracket.id}',
+            {round: bracket.round_digest(round) for round in bracket.layout.round_boxes}, render_round)
+        return render_template('bracket.jinja2', bracket=bracket, rounds=rounds, smashggurl=smashggurl)
     elif bracket.type == BracketType.ROUND_ROBIN:
         return render_template('pool.jinja2', bracket=bracket, smashggurl=smashggurl)
 
 
-@app.route('/user/<int:user_id>')
-def user_tournaments(user_id):
+def json_response(body):
+    # Strong ETag from the body itself, so pollers get a 304 and nothing
+    # else as long as the bracket hasn't changed.
+    response = app.response_class(body, mimetype='application/json')
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@app.route('/api/search/<string:search>')
+def api_search(search):
+    return json_response(search_json(unquote_plus(search)))
+
+
+@cache.memoize(timeout=10*60)
+def search_json(search):
+    client = GGClient(logger=app.logger)
+    return json.dumps([t.as_dict() for t in client.search_for_tournaments(search)])
+
+
+@app.route('/api/bracket/<int:tournament_id>')
+def api_events(tournament_id):
+    return json_response(events_json(tournament_id))
+
+
+@cache.memoize(timeout=10*60)
+def events_json(tournament_id):
+    client = GGClient(logger=app.logger)
+    events, smashggurl = client.fetch(
+        client.melee_events_query(tournament_id),
+        client.smashgg_url_query(tournament_id, 0, 0, 0))
+    return json.dumps({'events': events, 'smashggurl': smashggurl})
+
+
+@app.route('/api/bracket/<int:tournament_id>/<int:event_id>')
+def api_phases(tournament_id, event_id):
+    return json_response(phases_json(tournament_id, event_id))
+
+
+@cache.memoize(timeout=10*60)
+def phases_json(tournament_id, event_id):
+    client = GGClient(logger=app.logger)
+    phases, smashggurl = client.fetch(
+        client.event_phases_query(event_id),
+        client.smashgg_url_query(tournament_id, event_id, 0, 0))
+    return json.dumps({'phases': phases, 'smashggurl': smashggurl})
+
+
+@app.route('/api/bracket/<int:tournament_id>/<int:event_id>/<int:phase_id>')
+def api_phase_groups(tournament_id, event_id, phase_id):
+    return json_response(phase_groups_json(tournament_id, event_id, phase_id))
+
+
+@cache.memoize(timeout=10*60)
+def phase_groups_json(tournament_id, event_id, phase_id):
     client = GGClient(logger=app.logger)
-    user = client.get_user(user_id)
+    phase_groups, smashggurl = client.fetch(
+        client.phase_groups_query(phase_id),
+        client.smashgg_url_query(tournament_id, event_id, phase_id, 0))
+    return json.dumps({'phase_groups': phase_groups, 'smashggurl': smashggurl})
+
+
+@app.route('/api/bracket/<int:tournament_id>/<int:event_id>/<int:phase_id>/<int:phase_group_id>')
+def api_bracket(tournament_id, event_id, phase_id, phase_group_id):
+    return json_response(bracket_json(tournament_id, event_id, phase_id, phase_group_id))
+
+
+@stale_while_revalidate(cache, soft_timeout=1*60, hard_timeout=10*60)
+async def bracket_json(tournament_id, event_id, phase_id, phase_group_id):
+    client = AsyncGGClient(logger=app.logger)
+    bracket, smashggurl = await client.fetch_bracket(phase_group_id, tournament_id,
+        client.smashgg_url_query(tournament_id, event_id, phase_id, phase_group_id))
+    return json.dumps(dict(bracket.as_dict(), smashggurl=smashggurl))
 
-    print(user['tournaments'])
 
-    user['upcoming'] = (filter(lambda elem: elem['startAt'] > int(time.time()) , user['tournaments']))
-    user['ongoing'] = (filter(lambda elem: (elem['startAt'] < int(time.time() and elem['endAt'] > int(time.time()))) , user['tournaments']))
-    user['finished'] = (filter(lambda elem: elem['endAt'] < int(time.time()) , user['tournaments']))
+@app.route('/user/<int:user_id>')
+def user_tournaments(user_id):
+    return user_page(user_id, request.args.get('before', type=int))
+
 
+@cache.memoize(timeout=60)
+def user_page(user_id, before):
+    client = GGClient(logger=app.logger)
+    user = client.get_user(user_id, before=before)
+    user['upcoming'], user['ongoing'], user['finished'] = split_tournaments(user, int(time.time()))
+    if user['more'] and user['tournaments']:
+        user['older'] = user['tournaments'][-1]['startAt']
     return render_template('user.jinja2', user=user)
 
+
+def split_tournaments(user, now):
+    # The tournaments are newest first, so the upcoming ones are a prefix
+    # found by bisecting starts, their negated startAt. Of the rest, only
+    # those that haven't ended yet are ongoing.
+    tournaments = user['tournaments']
+    started = bisect.bisect_left(user['starts'], -now)
+    ongoing, finished = [], []
+    for tournament in tournaments[started:]:
+        (ongoing if (tournament['endAt'] or 0) > now else finished).append(tournament)
+    return tournaments[:started], ongoing, finished
+
 # NO WHOMST FOR YOU!!!
 #@app.route('/whomst/')
 #def whomst_display():
@@ -0,0 +1,64 @@
+class SetBox(object):
+    __slots__ = ('set_id', 'round', 'x', 'y')
+
+    def __init__(self, set_id, round, x, y):
+        self.set_id = set_id
+        self.round = round
+        self.x = x
+        self.y = y
+
+
+class Section(object):
+    # One side of an elimination bracket as columns of set boxes, one per
+    # round, plus the lines from each set to the set its winner plays next.
+    def __init__(self, bracket, rounds, layout):
+        self.columns = []
+        self.boxes = []
+        boxes = {}
+        for column, round in enumerate(rounds):
+            x = column*(layout.set_width + layout.column_gap)
+            column_boxes = []
+            next_free = 0
+            for set in bracket.rounds[round]:
+                # Centre a set on the sets whose winners play it; anything
+                # else (first rounds, losers dropping down) goes below.
+                feeder_ys = [boxes[id].y for id in bracket.set_feeders.get(set.id, [])
+                             if id in boxes and bracket.winner_goes_to.get(id) == set.id]
+                y = sum(feeder_ys) / len(feeder_ys) if feeder_ys else next_free
+                y = max(y, next_free)
+                box = SetBox(set.id, round, x, int(y))
+                boxes[set.id] = box
+                column_boxes.append(box)
+                next_free = box.y + layout.set_height + layout.row_gap
+            self.columns.append((round, column_boxes))
+            self.boxes += column_boxes
+
+        self.width = max((box.x + layout.set_width for box in self.boxes), default=0)
+        self.height = max((box.y + layout.set_height for box in self.boxes), default=0)
+
+        # All connectors as a single SVG path.
+        lines = []
+        middle = layout.set_height // 2
+        for box in self.boxes:
+            next_box = boxes.get(bracket.winner_goes_to.get(box.set_id))
+            if next_box is None or next_box is box:
+                continue
+            start_x = box.x + layout.set_width
+            lines.append(f'M{start_x},{box.y + middle}H{start_x + layout.column_gap // 2}'
+                         f'V{next_box.y + middle}H{next_box.x}')
+        self.connectors = ''.join(lines)
+
+
+class BracketLayout(object):
+    # Positions of every set of a finalized elimination bracket, in pixels.
+    # Only depends on the shape of the bracket, which doesn't change once it
+    # is finalized, so it is worked out once and kept with the bracket.
+    set_width = 200
+    set_height = 48
+    column_gap = 40
+    row_gap = 16
+
+    def __init__(self, bracket):
+        self.upper = Section(bracket, bracket.ub_rounds, self)
+        self.lower = Section(bracket, bracket.lb_rounds, self)
+        self.round_boxes = dict(self.upper.columns + self.lower.columns)
@@ -0,0 +1,143 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram(object):
+    def __init__(self):
+        self.counts = [0]*(len(BUCKETS) + 1)
+        self.sum = 0
+        self.count = 0
+
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class RequestTimings(object):
+    # What one request spent on each kind of work, for its Server-Timing
+    # header. Work done for it on other threads adds to the same timings.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.counts = {}
+        self.sizes = {}
+
+
+    def add(self, name, seconds, size=None):
+        with self.lock:
+            self.durations[name] = self.durations.get(name, 0) + seconds
+            self.counts[name] = self.counts.get(name, 0) + 1
+            if size is not None:
+                self.sizes[name] = self.sizes.get(name, 0) + size
+
+
+    def server_timing(self):
+        entries = []
+        with self.lock:
+            for name, seconds in self.durations.items():
+                description = f'{self.counts[name]}x'
+                if name in self.sizes:
+                    description += f', {self.sizes[name] // 1024} KiB'
+                entries.append(f'{name};dur={seconds*1000:.1f};desc="{description}"')
+        entries.append(f'total;dur={(time.perf_counter() - self.started)*1000:.1f}')
+        return ', '.join(entries)
+
+
+class Metrics(object):
+    # Histograms of how long each kind of work takes, with the number of
+    # bytes it moved, for /metrics. Per process.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.sizes = {}
+        self.current = contextvars.ContextVar('request_timings', default=None)
+
+
+    def start_request(self):
+        timings = RequestTimings()
+        self.current.set(timings)
+        return timings
+
+
+    def end_request(self, endpoint):
+        timings = self.current.get()
+        if timings is None:
+            return None
+        self.current.set(None)
+        self.observe('request', time.perf_counter() - timings.started, label=endpoint)
+        return timings
+
+
+    def observe(self, name, seconds, size=None, label=None):
+        with self.lock:
+            histogram = self.histograms.get((name, label))
+            if histogram is None:
+                histogram = self.histograms[(name, label)] = Histogram()
+            histogram.observe(seconds)
+            if size is not None:
+                self.sizes[name] = self.sizes.get(name, 0) + size
+        timings = self.current.get()
+        if timings is not None and name != 'request':
+            timings.add(name, seconds, size)
+
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+
+    def in_context(self, fn):
+        # fn, run on whichever thread with the timings of the request that
+        # wrapped it, e.g. for the pages of a bracket fetched in a pool.
+        context = contextvars.copy_context()
+        return lambda *args: context.copy().run(fn, *args)
+
+
+    def exposition(self):
+        # The Prometheus text format.
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# TYPE kneise_{name}_seconds histogram')
+                for (histogram_name, label), histogram in sorted(self.histograms.items(), key=lambda item: str(item[0])):
+                    if histogram_name != name:
+                        continue
+                    labels = f'endpoint="{label}",' if label is not None else ''
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'kneise_{name}_seconds_bucket{{{labels}le="{bound}"}} {cumulative}')
+                    labels = f'{{{labels[:-1]}}}' if labels else ''
+                    lines.append(f'kneise_{name}_seconds_sum{labels} {histogram.sum:.6f}')
+                    lines.append(f'kneise_{name}_seconds_count{labels} {histogram.count}')
+            for name, size in sorted(self.sizes.items()):
+                lines.append(f'# TYPE kneise_{name}_bytes counter')
+                lines.append(f'kneise_{name}_bytes_total {size}')
+        return '\n'.join(lines) + '\n'
+
+
+_shared_metrics = None
+_shared_metrics_lock = threading.Lock()
+
+
+def shared_metrics():
+    global _shared_metrics
+    if _shared_metrics is None:
+        with _shared_metrics_lock:
+            if _shared_metrics is None:
+                _shared_metrics = Metrics()
+    return _shared_metrics
@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+import time
+from GGClient import GGClient
+from scheduler import Priority, shared_scheduler
+
+
+class UpstreamBudget(object):
+    # Stands in for the scheduler of the prefetch client and charges every
+    # request it lets through, GraphQL or REST, to a round's share of the
+    # rate limit. Once that is spent requests fail, even halfway through a
+    # bracket.
+    def __init__(self, scheduler, limit):
+        self.scheduler = scheduler
+        self.limit = limit
+        self.spent = 0
+        self.lock = threading.Lock()
+
+
+    @property
+    def exhausted(self):
+        return self.spent >= self.limit
+
+
+    def submit(self, request, priority=Priority.BACKGROUND):
+        with self.lock:
+            if self.spent >= self.limit:
+                raise ValueError('Prefetch budget spent')
+            self.spent += 1
+        return self.scheduler.submit(request, priority)
+
+
+class Prefetcher(object):
+    # Warms the model cache for Melee tournaments that are about to start or
+    # are running, from their events down to their brackets, so their first
+    # viewers don't pay for a cold fetch. Runs at background priority, so
+    # viewers always go first, and within a budget of requests per round.
+    #
+    # It runs on a daemon thread, so it needs a long-running process. On
+    # serverless deploys like Vercel the thread is frozen or killed between
+    # requests, and it isn't started there.
+    #
+    # Every worker process starts one, but only the one holding a lease on
+    # the shared cache prefetches, so the budget is spent once per host with
+    # the filesystem cache, or once overall with redis. The others take
+    # over when it stops renewing the lease.
+    lease_key = 'prefetch:lease'
+
+    def __init__(self, interval=None, budget=None, horizon=None, lookback=None, logger=None):
+        self.interval = interval or float(os.getenv('GG_PREFETCH_INTERVAL', 5*60))
+        self.budget = budget or int(os.getenv('GG_PREFETCH_BUDGET', 40))
+        # Tournaments starting within horizon seconds, or that started less
+        # than lookback seconds ago.
+        self.horizon = horizon or float(os.getenv('GG_PREFETCH_HORIZON', 6*60*60))
+        self.lookback = lookback or float(os.getenv('GG_PREFETCH_LOOKBACK', 3*24*60*60))
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.cache = None
+        self.owner = f'{os.getpid()}:{id(self)}'
+
+
+    def start(self, cache=None):
+        # cache is what the lease is taken on, without one this process
+        # always prefetches.
+        with self.lock:
+            if self.thread is None:
+                self.cache = cache
+                self.thread = threading.Thread(target=self._run, daemon=True, name='prefetch')
+                self.thread.start()
+
+
+    def holds_lease(self):
+        # Taken for two rounds at a time and renewed every round, so it
+        # only passes on once its holder has missed one.
+        if self.cache is None:
+            return True
+        timeout = int(2*self.interval)
+        if self.cache.add(self.lease_key, self.owner, timeout=timeout):
+            return True
+        if self.cache.get(self.lease_key) == self.owner:
+            self.cache.set(self.lease_key, self.owner, timeout=timeout)
+            return True
+        return False
+
+
+    def _run(self):
+        while True:
+            try:
+                if self.holds_lease():
+                    self.prefetch()
+            except Exception:
+                self.logger.exception('Prefetching failed')
+            time.sleep(self.interval)
+
+
+    def _tournaments(self, client):
+        now = time.time()
+        tournaments = [t for t in client.get_coming_tournaments()
+                       if -self.lookback <= t.date.timestamp() - now <= self.horizon]
+        # Running and imminent tournaments first.
+        return sorted(tournaments, key=lambda t: abs(t.date.timestamp() - now))
+
+
+    def prefetch(self):
+        # One round, breadth first: every tournament's events before any of
+        # their phases, and so on down to the brackets, so a small budget
+        # goes to the pages viewers reach first. Returns the requests spent.
+        budget = UpstreamBudget(shared_scheduler(), self.budget)
+        client = GGClient(logger=self.logger, scheduler=budget, priority=Priority.BACKGROUND)
+
+        tournament_ids = [t.id for t in self._tournaments(client)]
+        events = self._each(budget, tournament_ids, lambda tid: [
+            (tid, event_id) for event_id in client.fetch(client.melee_events_query(tid))[0]])
+        phases = self._each(budget, events, lambda event: [
+            (event[0], phase_id) for phase_id in client.fetch(client.event_phases_query(event[1]))[0]])
+        phase_groups = self._each(budget, phases, lambda phase: [
+            (phase[0], phase_group['id']) for phase_group in client.fetch(client.phase_groups_query(phase[1]))[0]])
+        brackets = self._each(budget, phase_groups, lambda phase_group: [
+            client.fetch_bracket(phase_group[1], phase_group[0])])
+
+        self.logger.info(f'Prefetched {len(brackets)} brackets of {len(tournament_ids)} tournaments '
+                         f'in {budget.spent} requests')
+        return budget.spent
+
+
+    def _each(self, budget, items, fetch):
+        # The results of fetch for every item, until the budget runs out. A
+        # tournament without Melee or a bracket start.gg refuses is skipped.
+        results = []
+        for item in items:
+            if budget.exhausted:
+                break
+            try:
+                results += fetch(item)
+            except ValueError as e:
+                self.logger.info(f'Not prefetching {item}: {e}')
+        return results
+
+
+_shared_prefetcher = None
+_shared_prefetcher_lock = threading.Lock()
+
+
+def shared_prefetcher():
+    global _shared_prefetcher
+    if _shared_prefetcher is None:
+        with _shared_prefetcher_lock:
+            if _shared_prefetcher is None:
+                _shared_prefetcher = Prefetcher()
+    return _shared_prefetcher
@@ -0,0 +1,177 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+
+class Priority(object):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class UpstreamScheduler(object):
+    def __init__(self, requests_per_minute=None, burst=None, max_retries=None,
+                 failure_threshold=None, cooldown=None, clock=time.monotonic):
+        # start.gg allows 80 requests per minute per token. Tokens refill at
+        # whatever the burst leaves of that, so a full burst followed by a
+        # minute of steady traffic still stays inside the limit.
+        requests_per_minute = requests_per_minute or int(os.getenv('GG_RATE_LIMIT', 80))
+        self.clock = clock
+        self.burst = burst or int(os.getenv('GG_RATE_BURST', 20))
+        self.rate = max(requests_per_minute - self.burst, 1) / 60
+        self.tokens = self.burst
+        self.refilled_at = self.clock()
+        self.paused_until = 0
+
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('GG_MAX_RETRIES', 3))
+        self.backoff_base = 0.5
+        self.backoff_cap = 8
+
+        self.failure_threshold = failure_threshold or int(os.getenv('GG_BREAKER_THRESHOLD', 5))
+        self.cooldown = cooldown or float(os.getenv('GG_BREAKER_COOLDOWN', 30))
+        self.consecutive_failures = 0
+        self.open_until = 0
+
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.tickets = itertools.count()
+
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at)*self.rate)
+        self.refilled_at = now
+
+
+    def acquire(self, priority=Priority.INTERACTIVE):
+        # Waiters queue by priority and then arrival, and only the head of the
+        # queue may take a token, so a backlog of background requests never
+        # delays an interactive one by more than a single refill.
+        with self.condition:
+            ticket = (priority, next(self.tickets))
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    now = self.clock()
+                    self._refill(now)
+                    if self.waiting[0] == ticket:
+                        if now >= self.paused_until and self.tokens >= 1:
+                            self.tokens -= 1
+                            return
+                        wait = max(self.paused_until - now, (1 - self.tokens)/self.rate)
+                    else:
+                        wait = None
+                    self.condition.wait(wait)
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+
+    def pause(self, seconds):
+        with self.condition:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+            self.tokens = 0
+
+
+    def _check_breaker(self):
+        with self.condition:
+            if self.clock() < self.open_until:
+                raise ValueError('start.gg is not responding, try again in a little while')
+
+
+    def _record(self, success):
+        with self.condition:
+            if success:
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.open_until = self.clock() + self.cooldown
+
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base*2**attempt))
+
+
+    def _retry_after(self, response):
+        try:
+            return float(response.headers.get('Retry-After', ''))
+        except ValueError:
+            return None
+
+
+    def submit(self, request, priority=Priority.INTERACTIVE):
+        # request performs one HTTP call and returns the response. Rate limits,
+        # server errors and connection failures are retried with jittered
+        # exponential backoff; anything else is the caller's to handle.
+        for attempt in range(self.max_retries + 1):
+            self._check_breaker()
+            self.acquire(priority)
+            try:
+                response = request()
+            except OSError:
+                self._record(False)
+                if attempt == self.max_retries:
+                    raise ValueError('Could not reach start.gg') from None
+                time.sleep(self._backoff(attempt))
+                continue
+
+            if response.status_code != 429 and response.status_code < 500:
+                self._record(True)
+                return response
+            self._record(False)
+            if response.status_code == 429:
+                # Everyone in the process is over budget, not just us, so
+                # hold back the whole bucket rather than only this request,
+                # even when this request gives up.
+                self.pause(self._retry_after(response) or self._backoff(attempt))
+            if attempt == self.max_retries:
+                return response
+            if response.status_code != 429:
+                time.sleep(self._backoff(attempt))
+
+
+class SingleFlight(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+
+    def do(self, key, fn):
+        # The first caller for a key runs fn; anyone asking for the same key
+        # while it runs waits for and shares its result or exception.
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self.calls[key] = Future()
+        if not is_leader:
+            return call.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+_shared_scheduler = None
+_shared_scheduler_lock = threading.Lock()
+
+
+def shared_scheduler():
+    global _shared_scheduler
+    if _shared_scheduler is None:
+        with _shared_scheduler_lock:
+            if _shared_scheduler is None:
+                _shared_scheduler = UpstreamScheduler()
+    return _shared_scheduler
@@ -0,0 +1,66 @@
+// Keeps an elimination bracket page up to date, set by set, instead of
+// reloading the page. Polls the JSON of the bracket with its ETag, so a poll
+// where nothing changed costs a 304 and no upstream call.
+(function () {
+  var interval = 15000;
+  var url = '/api' + location.pathname;
+  var etag = null;
+  var seen = {};
+
+  function updateGame(game, entrant, score, won) {
+    var link = game.querySelector('a');
+    link.textContent = entrant ? entrant.name : '';
+    link.href = '/user/' + (entrant ? entrant.participant_id : 3817930);
+    game.querySelector('span').textContent = score === null ? '-' : score;
+    game.classList.toggle('winner', won);
+  }
+
+  function update(bracket) {
+    var entrants = {};
+    bracket.entrants.forEach(function (entrant) {
+      entrants[entrant.id] = entrant;
+    });
+    bracket.sets.forEach(function (set) {
+      var json = JSON.stringify(set);
+      if (seen[set.id] === json) {
+        return;
+      }
+      seen[set.id] = json;
+      var box = document.querySelector('.set[data-set="' + set.id + '"]');
+      if (!box) {
+        return;
+      }
+      var games = box.querySelectorAll('.game');
+      set.slots.forEach(function (slot, i) {
+        var entrant = slot.entrant_id === null ? null : entrants[slot.entrant_id];
+        var won = slot.entrant_id !== null && slot.entrant_id === set.winner_id;
+        updateGame(games[i], entrant, slot.score, won);
+      });
+    });
+  }
+
+  function poll() {
+    var headers = etag ? {'If-None-Match': etag} : {};
+    fetch(url, {headers: headers, cache: 'no-store'}).then(function (response) {
+      if (response.status === 304) {
+        return null;
+      }
+      if (!response.ok) {
+        throw new Error(response.status);
+      }
+      etag = response.headers.get('ETag');
+      return response.json();
+    }).then(function (bracket) {
+      if (bracket) {
+        update(bracket);
+      }
+      if (!bracket || !bracket.completed) {
+        setTimeout(poll, interval);
+      }
+    }).catch(function () {
+      setTimeout(poll, interval * 4);
+    });
+  }
+
+  setTimeout(poll, interval);
+})();
@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Set before any test imports the app: GGClient needs an API key, and the
+# archive gets a directory of its own rather than the machine's one.
+os.environ.setdefault('SMASHGG_API_KEY', 'test')
+os.environ.setdefault('GG_ARCHIVE_PATH', os.path.join(tempfile.mkdtemp(prefix='kneise-test-'), 'archive.db'))
+os.environ.setdefault('GG_CACHE_TYPE', 'simple')
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from archive import Archive
+from GGClient import AsyncGGClient, GGClient, GGConstant, GGQuery, split_composed
+from caching import LocalCache, ModelCache
+from scheduler import Priority
+from bench.synth import SyntheticPhaseGroup
+
+
+COMPLEXITY_ERROR = {'errors': [{'message': 'Your query complexity is too high. A maximum of 1000 objects may be returned by each request.'}]}
+
+
+class StubClient(GGClient):
+    # Answers the bracket query, composed with an event query or not, and
+    # turns down pages larger than max_per_page the way start.gg does: with
+    # an error that has no path.
+    def __init__(self, phase_group, max_per_page):
+        super().__init__()
+        self.models = ModelCache(LocalCache())
+        self.phase_group = phase_group
+        self.max_per_page = max_per_page
+        self.refresh_error = None
+        self.requests = []
+
+
+    def _updated_sets(self, variables):
+        if self.refresh_error:
+            return self.refresh_error
+        sets = [set for set in self.phase_group.sets if set['updatedAt'] > variables['updatedAfter']]
+        page, per_page = variables['page'], variables['perPage']
+        return {'data': {'phaseGroup': {'sets': {
+            'pageInfo': {'total': len(sets), 'totalPages': -(-len(sets) // per_page)},
+            'nodes': sets[(page - 1)*per_page:page*per_page]}}}}
+
+
+    def _execute_gql(self, gql, variables):
+        self.requests.append(variables)
+        if 'updatedAfter' in variables:
+            return self._updated_sets(variables)
+        prefix = 'q0_' if 'q0_perPage' in variables else ''
+        per_page = variables[prefix + 'perPage']
+        if per_page > self.max_per_page:
+            return COMPLEXITY_ERROR
+        data = self.phase_group.result(variables[prefix + 'page'], per_page)['data']
+        response = {prefix + field: value for field, value in data.items()}
+        if prefix:
+            response['q1_event'] = {'name': 'Melee Singles', 'slug': 'tournament/t/event/melee-singles',
+                                    'state': 'ACTIVE', 'phases': [], 'tournament': {'name': 'Synthetic'}}
+        return {'data': response}
+
+
+class Response(object):
+    status_code = 200
+    content = b'{}'
+
+    def json(self):
+        return {'data': {}}
+
+
+class HeldScheduler(object):
+    # Lets interactive requests through and holds background ones until
+    # released, like a rate limit that is serving viewers first.
+    def __init__(self):
+        self.released = threading.Event()
+        self.background_waiting = threading.Event()
+        self.interactive = 0
+
+
+    def submit(self, request, priority=Priority.INTERACTIVE):
+        if priority == Priority.BACKGROUND:
+            self.background_waiting.set()
+            self.released.wait(5)
+        else:
+            self.interactive += 1
+        return request()
+
+
+class Transport(object):
+    def post(self, url, json, headers):
+        return Response()
+
+
+class SplitComposedTest(unittest.TestCase):
+    def test_errors_without_a_path_go_to_every_query(self):
+        queries = [GGQuery('', {}, None), GGQuery('', {}, None)]
+        response = {'data': {'q1_event': {}}, 'errors': [{'message': 'complexity', 'path': None},
+                                                        {'message': 'not found', 'path': ['q1_event']}]}
+        parts = [part for _, part in split_composed(queries, response)]
+        self.assertEqual([e['message'] for e in parts[0]['errors']], ['complexity'])
+        self.assertEqual([e['message'] for e in parts[1]['errors']], ['complexity', 'not found'])
+
+
+class FetchBracketTest(unittest.TestCase):
+    def test_composed_page_backs_off_on_complexity_error(self):
+        phase_group = SyntheticPhaseGroup(7, 16, 'SINGLE_ELIMINATION', completed=0.5)
+        client = StubClient(phase_group, max_per_page=4)
+        bracket, url = client.fetch_bracket(7, 1, client.smashgg_url_query(1, 11, 21, 7))
+        self.assertEqual(len(bracket.sets), len(phase_group.sets))
+        self.assertEqual(url, 'smash.gg/tournament/t/event/melee-singles/brackets/21/7')
+        self.assertLessEqual(client.requests[-1].get('perPage', 0), 4)
+
+
+class ArchiveTest(unittest.TestCase):
+    def test_only_completed_phase_groups_are_archived(self):
+        client = GGClient()
+        client.archive = Archive(os.path.join(tempfile.mkdtemp(prefix='kneise-test-'), 'archive.db'))
+        # Every set played so far, but start.gg may still add or correct some.
+        result = SyntheticPhaseGroup(5, 4, 'SINGLE_ELIMINATION').result()
+        result['data']['phaseGroup']['state'] = 2
+        client._archive_if_completed('playing', result, [])
+        self.assertIsNone(client.archive.get('bracket', 'playing'))
+        result['data']['phaseGroup']['state'] = 3
+        client._archive_if_completed('done', result, [])
+        self.assertIsNotNone(client.archive.get('bracket', 'done'))
+
+
+class BracketBatchesTest(unittest.TestCase):
+    def phase_group(self, id, type, entrants):
+        return {'id': id, 'bracketType': type, 'seeds': {'nodes': [{'id': i} for i in range(entrants)]}}
+
+
+    def test_pages_packed_under_complexity_limit(self):
+        client = GGClient()
+        # 32 pools of 4, 6 sets each, and two bigger brackets.
+        phase_groups = [self.phase_group(id, 'ROUND_ROBIN', 4) for id in range(1, 33)]
+        phase_groups += [self.phase_group(40, 'DOUBLE_ELIMINATION', 8), self.phase_group(41, 'SINGLE_ELIMINATION', 64)]
+        batches = client._bracket_batches(1, phase_groups)
+
+        objects_per_set = client._bracket_set_objects()
+        complexities = [sum(GGConstant.bracket_query_overhead + per_page*objects_per_set for _, per_page, _ in batch)
+                        for batch in batches]
+        self.assertTrue(all(complexity <= GGConstant.complexity_limit for complexity in complexities))
+        ids = sorted(id for batch in batches for id, _, _ in batch)
+        self.assertEqual(ids, sorted(phase_group['id'] for phase_group in phase_groups))
+        # First fit decreasing: the big bracket fills a request on its own,
+        # the 16 sets of the double elimination one leave room for 3 pools
+        # and the other pools go 6 to a request.
+        self.assertEqual(sorted(len(batch) for batch in batches), [1, 4, 5, 6, 6, 6, 6])
+
+
+class InFlightTest(unittest.TestCase):
+    def test_viewer_does_not_wait_for_background_request(self):
+        scheduler = HeldScheduler()
+        background = GGClient(transport=Transport(), scheduler=scheduler, priority=Priority.BACKGROUND)
+        viewer = GGClient(transport=Transport(), scheduler=scheduler)
+        thread = threading.Thread(target=background._execute_gql, args=('query q { a }', {'id': 1}))
+        thread.start()
+        try:
+            self.assertTrue(scheduler.background_waiting.wait(5))
+            self.assertEqual(viewer._execute_gql('query q { a }', {'id': 1}), {'data': {}})
+            self.assertEqual(scheduler.interactive, 1)
+        finally:
+            scheduler.released.set()
+            thread.join()
+
+
+class AsyncGGClientTest(unittest.TestCase):
+    def test_awaits_calls_concurrently(self):
+        client = AsyncGGClient(transport=Transport(), scheduler=HeldScheduler())
+
+        async def both():
+            return await asyncio.gather(
+                client.fetch(GGQuery('query a { a }', {}, lambda r: r['data'])),
+                client.fetch(GGQuery('query b { b }', {}, lambda r: r['data'])))
+        self.assertEqual(asyncio.run(both()), [[{}], [{}]])
+        self.assertEqual(client.smashgg_url_query(1, 0, 0, 0).variables, {'profileId': 1})
+
+
+class RefreshBracketTest(unittest.TestCase):
+    def setUp(self):
+        self.phase_group = SyntheticPhaseGroup(8, 8, 'DOUBLE_ELIMINATION', completed=0.75)
+        self.client = StubClient(self.phase_group, max_per_page=100)
+        self.bracket = self.client.get_phase_group_bracket(8, 1)
+
+
+    def test_update_set(self):
+        set = self.phase_group.sets[0]
+        params = self.client._set_params(8, dict(set, displayScore='corrected'))
+        self.assertTrue(self.bracket.update_set(**params))
+        self.assertEqual(self.bracket.sets[set['id']].display_score, 'corrected')
+        self.assertIn(self.bracket.sets[set['id']], self.bracket.rounds[set['round']])
+        self.assertFalse(self.bracket.update_set(**dict(params, id=999999)))
+
+
+    def test_patches_updated_sets(self):
+        # A set that has been played can still have its score corrected.
+        set = self.phase_group.sets[0]
+        set['displayScore'] = 'corrected'
+        set['updatedAt'] = time.time() + 1
+        requests = len(self.client.requests)
+        self.assertTrue(self.client.refresh_bracket(self.bracket))
+        self.assertEqual(self.bracket.sets[set['id']].display_score, 'corrected')
+        self.assertEqual(len(self.client.requests) - requests, 1)
+
+
+    def test_unknown_set_needs_full_fetch(self):
+        set = dict(self.phase_group.sets[0], id=999999, updatedAt=time.time() + 1)
+        self.phase_group.sets.append(set)
+        self.assertFalse(self.client.refresh_bracket(self.bracket))
+
+
+    def test_falls_back_to_full_fetch_on_error(self):
+        self.client.refresh_error = {'errors': [{'message': 'Unknown argument updatedAfter'}]}
+        self.assertFalse(self.client.refresh_bracket(self.bracket))
+        # Past its ttl, the bracket is fetched again in full.
+        self.client.models.ttls = dict(self.client.models.ttls, phase_group=-1)
+        bracket = self.client.get_phase_group_bracket(8, 1)
+        self.assertEqual(len(bracket.sets), len(self.bracket.sets))
+        self.assertNotIn('updatedAfter', self.client.requests[-1])
+
+
+class SearchTest(unittest.TestCase):
+    def test_full_page_of_results_is_filtered(self):
+        # 500 nodes, a full page, may not be everything start.gg has, so the
+        # index can't answer the search; the page itself still can.
+        nodes = [{'id': 100 + i, 'name': f'Weekly {i}', 'slug': f'tournament/weekly-{i}', 'startAt': 1700000000 + i}
+                 for i in range(499)]
+        nodes.append({'id': 1, 'name': 'Zebra Cup', 'slug': 'tournament/zebra-cup', 'startAt': 1700000000})
+        client = GGClient()
+        client.models = ModelCache(LocalCache())
+        query = client.melee_tournaments_query('zebra')
+        tournaments = query.parse({'data': {'tournaments': {'nodes': nodes}}})
+        self.assertEqual([t.name for t in tournaments], ['Zebra Cup'])
+
+
+    def test_tournament_url(self):
+        client = GGClient()
+        tournaments = client._parse_rest_tournament(
+            {'entities': {'tournament': {'id': 7, 'name': 'Genesis 9', 'startAt': 1700000000}}})
+        self.assertEqual([t.as_dict()['name'] for t in tournaments], ['Genesis 9'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import unittest
+from unittest import mock
+
+import index
+from index import app
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+        self.token = os.environ.pop('GG_METRICS_TOKEN', None)
+
+
+    def tearDown(self):
+        os.environ.pop('GG_METRICS_TOKEN', None)
+        if self.token is not None:
+            os.environ['GG_METRICS_TOKEN'] = self.token
+
+
+    def test_hidden_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+    def test_needs_the_token(self):
+        os.environ['GG_METRICS_TOKEN'] = 'secret'
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 401)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'kneise_request_seconds', response.data)
+
+
+class ErrorTest(unittest.TestCase):
+    def test_api_errors_are_json(self):
+        def not_started(*args):
+            raise ValueError('Bracket has not started')
+        with mock.patch.object(index, 'bracket_json', not_started):
+            response = app.test_client().get('/api/bracket/1/2/3/4')
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.get_json(), {'error': 'Bracket has not started'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from cachelib import SimpleCache
+
+from prefetch import Prefetcher, UpstreamBudget
+
+
+class Scheduler(object):
+    def submit(self, request, priority):
+        return request()
+
+
+class UpstreamBudgetTest(unittest.TestCase):
+    def test_requests_past_the_budget_fail(self):
+        budget = UpstreamBudget(Scheduler(), 2)
+        self.assertEqual([budget.submit(lambda: 'ok'), budget.submit(lambda: 'ok')], ['ok', 'ok'])
+        self.assertTrue(budget.exhausted)
+        with self.assertRaises(ValueError):
+            budget.submit(lambda: 'ok')
+        self.assertEqual(budget.spent, 2)
+
+
+class LeaseTest(unittest.TestCase):
+    def test_one_process_per_cache_prefetches(self):
+        cache = SimpleCache()
+        first, second = Prefetcher(interval=60), Prefetcher(interval=60)
+        first.cache = second.cache = cache
+        self.assertTrue(first.holds_lease())
+        self.assertFalse(second.holds_lease())
+        # Renewed by its holder, and taken over once it lapses.
+        self.assertTrue(first.holds_lease())
+        cache.delete(Prefetcher.lease_key)
+        self.assertTrue(second.holds_lease())
+        self.assertFalse(first.holds_lease())
+
+
+if __name__ == '__main__':
+    unittest.main()
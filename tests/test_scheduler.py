@@ -0,0 +1,118 @@
+import threading
+import time
+import unittest
+
+from scheduler import Priority, UpstreamScheduler
+
+
+class Clock(object):
+    # Time that only moves when a test says so.
+    def __init__(self):
+        self.now = 1000.0
+
+
+    def __call__(self):
+        return self.now
+
+
+class Response(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.001)
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        # One token, refilled once a second.
+        self.scheduler = UpstreamScheduler(requests_per_minute=61, burst=1, max_retries=0,
+                                           failure_threshold=2, cooldown=30, clock=self.clock)
+
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        with self.scheduler.condition:
+            self.scheduler.condition.notify_all()
+
+
+    def acquire_in_thread(self, priority, order):
+        thread = threading.Thread(target=lambda: (self.scheduler.acquire(priority), order.append(priority)))
+        thread.start()
+        return thread
+
+
+    def test_interactive_before_queued_background(self):
+        self.scheduler.acquire()
+        order = []
+        background = self.acquire_in_thread(Priority.BACKGROUND, order)
+        wait_until(lambda: len(self.scheduler.waiting) == 1)
+        interactive = self.acquire_in_thread(Priority.INTERACTIVE, order)
+        wait_until(lambda: len(self.scheduler.waiting) == 2)
+
+        self.advance(1)
+        interactive.join(5)
+        self.assertEqual(order, [Priority.INTERACTIVE])
+        self.advance(1)
+        background.join(5)
+        self.assertEqual(order, [Priority.INTERACTIVE, Priority.BACKGROUND])
+
+
+    def test_rate_limited_response_pauses_the_bucket(self):
+        response = self.scheduler.submit(lambda: Response(429, {'Retry-After': '5'}))
+        self.assertEqual(response.status_code, 429)
+
+        # Any request, of any priority, waits out the Retry-After.
+        order = []
+        thread = self.acquire_in_thread(Priority.INTERACTIVE, order)
+        wait_until(lambda: len(self.scheduler.waiting) == 1)
+        self.advance(4)
+        thread.join(0.05)
+        self.assertEqual(order, [])
+        self.advance(1)
+        thread.join(5)
+        self.assertEqual(order, [Priority.INTERACTIVE])
+
+
+    def test_breaker_opens_and_reopens_after_cooldown(self):
+        calls = []
+
+        def unreachable():
+            calls.append(self.clock())
+            raise OSError('connection refused')
+
+        for _ in range(2):
+            self.advance(1)
+            with self.assertRaisesRegex(ValueError, 'Could not reach'):
+                self.scheduler.submit(unreachable)
+        # Open: nothing goes upstream until the cooldown is over.
+        with self.assertRaisesRegex(ValueError, 'not responding'):
+            self.scheduler.submit(unreachable)
+        self.assertEqual(len(calls), 2)
+
+        # One request is let through, and its failure opens it again.
+        self.advance(30)
+        with self.assertRaisesRegex(ValueError, 'Could not reach'):
+            self.scheduler.submit(unreachable)
+        self.assertEqual(len(calls), 3)
+        self.advance(1)
+        with self.assertRaisesRegex(ValueError, 'not responding'):
+            self.scheduler.submit(unreachable)
+
+        # A success closes it for good.
+        self.advance(30)
+        self.assertEqual(self.scheduler.submit(lambda: Response(200)).status_code, 200)
+        self.advance(1)
+        with self.assertRaisesRegex(ValueError, 'Could not reach'):
+            self.scheduler.submit(unreachable)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,15 @@
+import statistics
+import unittest
+
+from bench import startup
+
+
+class StartupTest(unittest.TestCase):
+    def test_import_time_within_budget(self):
+        # The same check as python -m bench.startup, with fewer runs.
+        totals, _ = startup.measure(3)
+        self.assertLessEqual(statistics.median(totals), startup.budget())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+
+from GGClient import GGClient
+from caching import LocalCache, ModelCache
+from bench.synth import SyntheticPhaseGroup
+
+
+def build(phase_group):
+    client = GGClient()
+    client.models = ModelCache(LocalCache())
+    bracket = client._build_bracket(phase_group.id, phase_group.result(), phase_group.sets)
+    bracket.finalize()
+    return bracket
+
+
+def preview(phase_group):
+    # Gives the sets the ids start.gg uses before a bracket starts, in the
+    # prereqs pointing at them as well.
+    ids = {set['id']: f"preview_{phase_group.id}_{set['round']}_{set['id']}" for set in phase_group.sets}
+    for set in phase_group.sets:
+        set['id'] = ids[set['id']]
+        for slot in set['slots']:
+            if slot['prereqType'] == 'set':
+                slot['prereqId'] = ids[int(slot['prereqId'])]
+    return phase_group
+
+
+class PathTest(unittest.TestCase):
+    def setUp(self):
+        # Seeds 1 to 8, only the first set, 1 against 8, has been played.
+        self.bracket = build(preview(SyntheticPhaseGroup(3, 8, 'SINGLE_ELIMINATION', completed=1/7)))
+        self.final = next(set for set in self.bracket.sets.values() if set.round == 3)
+
+
+    def test_feeders(self):
+        feeders = self.bracket.feeders(self.final.id)
+        self.assertEqual(sorted(set.round for set in feeders), [2, 2])
+        self.assertEqual(sorted(len(self.bracket.feeders(set.id)) for set in feeders), [2, 2])
+        self.assertEqual(self.bracket.winner_goes_to[feeders[0].id], self.final.id)
+
+
+    def test_path(self):
+        path = self.bracket.path(1001)
+        self.assertEqual([set.round for set in path], [1, 2])
+        self.assertTrue(path[0].completed)
+        self.assertEqual(self.bracket.path(1008), path[:1])
+
+
+    def test_next_set(self):
+        self.assertEqual(self.bracket.next_set(1001).round, 2)
+        self.assertIsNone(self.bracket.next_set(1008))
+        self.assertEqual(self.bracket.next_set(1004).round, 1)
+
+
+    def test_next_opponent(self):
+        # 4 against 5 hasn't been played, the better seed is assumed to win.
+        self.assertEqual(self.bracket.next_opponent(1001).id, 1004)
+        self.assertEqual(self.bracket.next_opponent(1004).id, 1005)
+        self.assertIsNone(self.bracket.next_opponent(1008))
+
+
+class LayoutTest(unittest.TestCase):
+    def test_sets_centred_on_their_feeders(self):
+        bracket = build(preview(SyntheticPhaseGroup(4, 16, 'SINGLE_ELIMINATION', completed=0)))
+        boxes = {box.set_id: box for box in bracket.layout.upper.boxes}
+        later_rounds = [set for set in bracket.sets.values() if set.round > 1]
+        self.assertTrue(later_rounds)
+        for set in later_rounds:
+            feeder_ys = [boxes[feeder.id].y for feeder in bracket.feeders(set.id)]
+            self.assertEqual(boxes[set.id].y, sum(feeder_ys) // 2)
+        self.assertTrue(bracket.layout.upper.connectors)
+
+
+class PoolTest(unittest.TestCase):
+    def test_pool_not_started_yet(self):
+        # start.gg gives the sets of a pool that hasn't started preview ids.
+        phase_group = SyntheticPhaseGroup(9, 6, 'ROUND_ROBIN', completed=0)
+        for set in phase_group.sets:
+            set['id'] = f"preview_9_{set['round']}_{set['id']}"
+        bracket = build(phase_group)
+        self.assertEqual(len(bracket.set_table()), len(phase_group.sets))
+        self.assertEqual(len(bracket.as_dict()['standings']), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,11 @@
+import hashlib
 import json
 import math
-from anytree import Node, RenderTree
+import sys
+from array import array
 from collections import defaultdict, deque
 from enum import Enum
+from layout import BracketLayout
 
 
 class BracketType(Enum):
@@ -24,31 +27,56 @@ class Tournament(object):
         self.date = date
 
 
+    def as_dict(self):
+        return {'id': self.id, 'name': self.name, 'date': self.date.isoformat()}
+
+
 class Prereq(object):
-    def __init__(self, id, type):
+    # For a set prereq, placement 1 is the set's winner and 2 its loser.
+    __slots__ = ('id', 'type', 'placement')
+
+    def __init__(self, id, type, placement=None):
         self.id = id
         self.type = type
+        self.placement = placement
 
 
 class Slot(object):
-    def __init__(self, entrant, prereq, index):
+    # The score lives on the slot, since one entrant object is shared by
+    # every set they play in.
+    __slots__ = ('entrant', 'prereq', 'index', 'score', 'decided')
+
+    def __init__(self, entrant, prereq, index, score, decided=True):
         self.entrant = entrant
         self.prereq = prereq
         self.index = index
+        self.score = score
+        # False while the slot holds a placeholder for an entrant to come.
+        self.decided = decided
 
 
 class Entrant(object):
-    def __init__(self, id, participant_id, name, score, seed):
+    __slots__ = ('id', 'participant_id', 'name', 'seed')
+
+    def __init__(self, id, participant_id, name, seed):
         self.id = id
         self.participant_id = participant_id
         self.name = name
-        self.score = score
         self.seed = seed
 
 
+    def as_dict(self):
+        return {'id': self.id, 'participant_id': self.participant_id, 'name': self.name, 'seed': self.seed}
+
+
 class Set(object):
+    __slots__ = ('id', 'phase_group_id', 'round', 'display_score', 'winner_id', 'identifier', 'is_gf',
+                 'completed', 'stream', 'slots', 'upper_slot', 'lower_slot')
+
     def __init__(self, id, phase_group_id, round, display_score, winner_id,
-                 identifier, is_gf, completed, slots, stream):
+                 identifier, is_gf, completed, slots, stream, entrants=None):
+        # entrants, if given, maps entrant ids to Entrant objects already
+        # created for the bracket; those are reused rather than duplicated.
         self.id = id
         self.phase_group_id = phase_group_id
         self.round = round
@@ -59,24 +87,34 @@ class Set(object):
         self.completed = completed
         self.stream = stream
 
+        if entrants is None:
+            entrants = {}
         self.slots = []
-        self.entrants = []
         for i, slot in enumerate(slots):
             # If there is no entrant in a slot, the entrant is not yet decided
             # (pools, previous set or similar).
             try:
                 entrant_id = slot['entrant']['id']
-                participant_id = slot['entrant']['participants'][0]['id']
-                entrant_name = slot['entrant']['participants'][0]['gamerTag']
-                entrant_seeds = slot['entrant']['seeds']
-                for seed in entrant_seeds:
-                    if seed['phaseGroup']['id'] == phase_group_id:
-                        entrant_seed = seed['seedNum']
+                decided = True
             except TypeError:
                 entrant_id = i
-                participant_id = 3817930
-                entrant_name = ''
-                entrant_seed = 0
+                decided = False
+
+            entrant = entrants.get(entrant_id)
+            if entrant is None:
+                try:
+                    participant_id = slot['entrant']['participants'][0]['id']
+                    entrant_name = slot['entrant']['participants'][0]['gamerTag']
+                    entrant_seeds = slot['entrant']['seeds']
+                    entrant_seed = 0
+                    for seed in entrant_seeds:
+                        if seed['phaseGroup']['id'] == phase_group_id:
+                            entrant_seed = seed['seedNum']
+                except TypeError:
+                    participant_id = 3817930
+                    entrant_name = ''
+                    entrant_seed = 0
+                entrant = Entrant(entrant_id, participant_id, entrant_name, entrant_seed)
 
             # If we have an entrant, they may have no updated score yet, making
             # their score 0. If no entrant, then the set hasn't begun.
@@ -85,64 +123,201 @@ class Set(object):
             except TypeError:
                 entrant_score = '-'
 
-            try:
-                prereq_type = slot['prereqType']
-                prereq_id = int(slot['prereqId'])
-            except ValueError:
-                prereq_type = 'previous_phase'
-                prereq_id = None
-            prereq = Prereq(prereq_id, prereq_type)
+            # Sets not started yet have ids like 'preview_123_1_2', and the
+            # prereqs pointing at them too, so set prereqs keep theirs.
+            prereq_type = slot['prereqType']
+            prereq_id = slot['prereqId']
+            if prereq_type != 'set' or str(prereq_id).isdigit():
+                try:
+                    prereq_id = int(prereq_id)
+                except (TypeError, ValueError):
+                    prereq_type = 'previous_phase'
+                    prereq_id = None
+            prereq = Prereq(prereq_id, prereq_type, slot.get('prereqPlacement'))
             index = slot['slotIndex']
 
-            entrant = Entrant(entrant_id, participant_id, entrant_name, entrant_score, entrant_seed)
-            self.slots.append(Slot(entrant, prereq, index))
-
-            # For creating pools later, where we can do a lookup to determine
-            # the order of the scoring. Not optimal.
-            if entrant_id == self.winner_id:
-                self.winner_seed = entrant_seed
-                self.winner_score = entrant_score
-            else:
-                self.loser_seed = entrant_seed
-                self.loser_score = entrant_score
+            self.slots.append(Slot(entrant, prereq, index, entrant_score, decided))
         self.slots.sort(key=lambda s: s.index)
 
         self.upper_slot = self.slots[0]
         self.lower_slot = self.slots[1]
 
-        self._parent = None
-        self._children = {}
+
+    @property
+    def entrants(self):
+        return [slot.entrant for slot in self.slots]
+
+
+    def as_dict(self):
+        slots = []
+        for slot in self.slots:
+            slots.append({
+                'entrant_id': slot.entrant.id if slot.decided else None,
+                'score': None if slot.score == '-' else slot.score,
+                'prereq': {'id': slot.prereq.id, 'type': slot.prereq.type, 'placement': slot.prereq.placement},
+            })
+        return {
+            'id': self.id,
+            'round': self.round,
+            'identifier': self.identifier,
+            'display_score': self.display_score,
+            'winner_id': self.winner_id,
+            'completed': self.completed,
+            'is_gf': self.is_gf,
+            'stream': self.stream,
+            'slots': slots,
+        }
 
 
     def __str__(self):
         return f'Set ended: {self.display_score}'
 
 
-    def _add_parent(self, set):
-        self._parent = set
-
-
-    def _add_child(self, set):
-        self._children[set.id] = set
+class SetTable(object):
+    # The sets' scalar fields as typed arrays, one entry per set in the order
+    # of bracket.sets, for code that scans every set without walking the Set
+    # objects. Scores not reported yet are NaN, undecided winners -1. Set ids
+    # stay a list, sets not started yet have ids like 'preview_123_1_2'.
+    __slots__ = ('ids', 'rounds', 'completed', 'winner_slot', 'upper_entrant', 'lower_entrant',
+                 'upper_score', 'lower_score')
+
+    def __init__(self, sets):
+        self.ids = []
+        self.rounds = array('l')
+        self.completed = array('b')
+        self.winner_slot = array('b')
+        self.upper_entrant = array('q')
+        self.lower_entrant = array('q')
+        self.upper_score = array('d')
+        self.lower_score = array('d')
+
+        def score(slot):
+            return float(slot.score) if isinstance(slot.score, (int, float)) else math.nan
+
+        for set in sets:
+            upper, lower = set.slots[0], set.slots[1]
+            self.ids.append(set.id)
+            self.rounds.append(set.round)
+            self.completed.append(set.completed)
+            if set.winner_id is None:
+                self.winner_slot.append(-1)
+            else:
+                self.winner_slot.append(0 if upper.entrant.id == set.winner_id else 1)
+            self.upper_entrant.append(upper.entrant.id)
+            self.lower_entrant.append(lower.entrant.id)
+            self.upper_score.append(score(upper))
+            self.lower_score.append(score(lower))
 
 
-    def connect(self, next_round):
-        for next_round_set in next_round:
-            if self.winner_id in next_round_set.slots:
-                self._add_parent(next_round_set)
-                next_round_set._add_child(self)
-                break
+    def __len__(self):
+        return len(self.ids)
 
 
-class PoolResult(object):
-    def __init__(self, completed, left_score, right_score):
-        self.left_score = left_score
-        self.right_score = right_score
-        self.dq = self.left_score == -1 or self.right_score == -1
-        if completed:
-            self.status = 'win' if self.left_score > self.right_score else 'loss'
-        else:
-            self.status = 'uncompleted'
+    @property
+    def nbytes(self):
+        columns = [getattr(self, name) for name in self.__slots__ if name != 'ids']
+        return sys.getsizeof(self.ids) + sum(len(column)*column.itemsize for column in columns)
+
+
+class PoolResults(object):
+    # Round robin results as n*n NumPy matrices, row entrant against column
+    # entrant in the order of the given entrants, filled from the set table
+    # in one pass. Standings are worked out from the same matrices.
+    def __init__(self, entrants, table):
+        import numpy as np
+
+        self.entrants = entrants
+        n = len(entrants)
+        ids = np.array([entrant.id for entrant in entrants], dtype=np.int64)
+        by_id = np.argsort(ids)
+
+        def positions(entrant_ids):
+            entrant_ids = np.frombuffer(entrant_ids, dtype=np.int64)
+            return by_id[np.searchsorted(ids, entrant_ids, sorter=by_id)]
+
+        upper = positions(table.upper_entrant)
+        lower = positions(table.lower_entrant)
+        completed = np.frombuffer(table.completed, dtype=np.int8).astype(bool)
+        winner_slot = np.frombuffer(table.winner_slot, dtype=np.int8)
+
+        self.played = np.zeros((n, n), dtype=bool)
+        self.played[upper, lower] = self.played[lower, upper] = True
+        self.completed = np.zeros((n, n), dtype=bool)
+        self.completed[upper, lower] = self.completed[lower, upper] = completed
+        # Games won by the row entrant against the column entrant; start.gg
+        # reports a DQ as a score of -1.
+        self.games = np.full((n, n), np.nan)
+        self.games[upper, lower] = np.frombuffer(table.upper_score, dtype=np.float64)
+        self.games[lower, upper] = np.frombuffer(table.lower_score, dtype=np.float64)
+        self.won = np.zeros((n, n), dtype=bool)
+        upper_won = completed & (winner_slot == 0)
+        lower_won = completed & (winner_slot == 1)
+        self.won[upper[upper_won], lower[upper_won]] = True
+        self.won[lower[lower_won], upper[lower_won]] = True
+        self.dq = self.completed & (self.games == -1)
+
+        self.set_wins = self.won.sum(axis=1)
+        self.set_losses = self.won.sum(axis=0)
+        # Sets with a DQ don't count towards games.
+        counted = self.completed & ~self.dq & ~self.dq.T
+        self.game_wins = np.where(counted, np.nan_to_num(self.games), 0).sum(axis=1).astype(int)
+        self.game_losses = np.where(counted, np.nan_to_num(self.games.T), 0).sum(axis=1).astype(int)
+        self.dqs = self.dq.sum(axis=1)
+        self.game_ratio = self.game_wins / np.maximum(self.game_wins + self.game_losses, 1)
+
+        # Ranked on set wins, then sets won among those tied on set wins, then
+        # game ratio, then fewer DQs, and finally seed.
+        tied = self.set_wins[:, None] == self.set_wins[None, :]
+        self.head_to_head = (self.won & tied).sum(axis=1)
+        seeds = np.array([entrant.seed for entrant in entrants], dtype=np.float64)
+        self.ranking = np.lexsort((seeds, self.dqs, -self.game_ratio, -self.head_to_head, -self.set_wins))
+
+
+    def rows(self):
+        # (css class, text) per cell, for the pool grid. A cell's text only
+        # depends on the pair of scores in it, so each distinct pair is
+        # formatted once rather than once per cell.
+        import numpy as np
+
+        status = np.select([self.won, self.completed, self.played], [3, 2, 1], 0)
+        scores = np.where(np.isnan(self.games), -2, self.games).astype(np.int64) + 2
+        pairs = scores*1000 + scores.T
+        pairs[~self.played] = -1
+        pairs[self.dq | self.dq.T] = -2
+        codes, inverse = np.unique(pairs, return_inverse=True)
+        texts = np.array([_pool_cell_text(code) for code in codes.tolist()], dtype=object)[inverse.reshape(pairs.shape)]
+        css_classes = np.array(['diag', 'uncompleted', 'loss', 'win'], dtype=object)[status]
+        return [list(zip(row_classes, row_texts)) for row_classes, row_texts in zip(css_classes.tolist(), texts.tolist())]
+
+
+    def standings(self):
+        standings = []
+        for rank, i in enumerate(self.ranking.tolist(), 1):
+            entrant = self.entrants[i]
+            standings.append({
+                'rank': rank,
+                'name': entrant.name,
+                'participant_id': entrant.participant_id,
+                'set_wins': int(self.set_wins[i]),
+                'set_losses': int(self.set_losses[i]),
+                'game_wins': int(self.game_wins[i]),
+                'game_losses': int(self.game_losses[i]),
+                'game_ratio': float(self.game_ratio[i]),
+                'dqs': int(self.dqs[i]),
+            })
+        return standings
+
+
+def _pool_cell_text(code):
+    if code == -2:
+        return 'DQ'
+    elif code == -1:
+        return '-'
+
+    def score(value):
+        return '-' if value == 0 else str(value - 2)
+    left, right = divmod(code, 1000)
+    return f'{score(left)} - {score(right)}'
 
 
 class Bracket(object):
@@ -154,6 +329,22 @@ class Bracket(object):
         self.rounds = {}
         self.sets = {}
         self.entrants = {}
+        # Which round each set is listed under, so a set can be swapped out
+        # without searching every round.
+        self.set_rounds = {}
+        self.refreshed_at = 0
+        self.finalized = False
+        self._set_table = None
+        self.round_digests = {}
+        # The set graph, by set id: the sets feeding each set, where a set's
+        # winner and loser go next, and how far each set is from the start
+        # of the bracket. Filled in by finalize.
+        self.set_feeders = {}
+        self.winner_goes_to = {}
+        self.loser_goes_to = {}
+        self.set_depths = {}
+        self.entrant_sets = {}
+        self.layout = None
 
 
     def get_rounds(self):
@@ -170,6 +361,11 @@ class Bracket(object):
         return list(reversed([r for r in self.get_rounds() if r < 0]))
 
 
+    @property
+    def completed(self):
+        return all(set.completed for set in self.sets.values())
+
+
     @property
     def grand_final(self):
         return self.rounds[max(self.get_rounds())][0]
@@ -180,8 +376,53 @@ class Bracket(object):
         return self.rounds[min(self.get_rounds())][0]
 
 
+    def as_dict(self):
+        # Everything about a finalized bracket, for the JSON API.
+        sets = []
+        for set in self.sets.values():
+            set_dict = set.as_dict()
+            set_dict['winner_goes_to'] = self.winner_goes_to.get(set.id)
+            set_dict['loser_goes_to'] = self.loser_goes_to.get(set.id)
+            sets.append(set_dict)
+        bracket = {
+            'id': self.id,
+            'name': self.name,
+            'type': self.type.name,
+            'tournament_name': self.tournament_name,
+            'completed': self.completed,
+            'entrants': [entrant.as_dict() for entrant in sorted(
+                (self.entrants[id] for id in self.entrant_sets), key=lambda entrant: entrant.seed)],
+            'rounds': {round: [set.id for set in self.rounds[round]] for round in self.get_rounds()},
+            'sets': sets,
+        }
+        if self.type == BracketType.ROUND_ROBIN:
+            bracket['standings'] = self.pool.standings()
+        return bracket
+
+
+    def round_digest(self, round):
+        # Changes whenever anything shown for the sets of a round does. Kept
+        # until a set in the round is added or updated.
+        if round not in self.round_digests:
+            digest = hashlib.sha1()
+            for set in self.rounds[round]:
+                slots = [(slot.entrant.id, slot.entrant.participant_id, slot.entrant.name, slot.score) for slot in set.slots]
+                digest.update(repr((set.id, set.winner_id, set.completed, set.stream, slots)).encode())
+            self.round_digests[round] = digest.hexdigest()
+        return self.round_digests[round]
+
+
+    def set_table(self):
+        # Built on first use and kept until a set is added or updated.
+        if self._set_table is None:
+            self._set_table = SetTable(self.sets.values())
+        return self._set_table
+
+
     def add_set(self, id, phase, round, display_score, winner_id, identifier, is_gf, completed, slots, stream):
-        set = Set(id, phase, round, display_score, winner_id, identifier, is_gf, completed, slots, stream)
+        self._set_table = None
+        self.round_digests.pop(round, None)
+        set = Set(id, phase, round, display_score, winner_id, identifier, is_gf, completed, slots, stream, self.entrants)
 
         # Add to smorgasbord for all sets.
         self.sets[set.id] = set
@@ -192,13 +433,40 @@ class Bracket(object):
         except KeyError:
             self.rounds[round] = []
             self.rounds[round].append(set)
+        self.set_rounds[set.id] = round
+
+        self._add_entrants(set)
 
-        # Add entrants of the set.
+
+    def _add_entrants(self, set):
         for slot in set.slots:
             if slot.entrant.id not in self.entrants:
                 self.entrants[slot.entrant.id] = slot.entrant
 
 
+    def update_set(self, id, phase, round, display_score, winner_id, identifier, is_gf, completed, slots, stream):
+        # Replaces a set with its latest state, in place, keeping its position
+        # within its round. Sets we haven't seen before mean the bracket was
+        # rebuilt on smash.gg, which can't be patched.
+        if id not in self.sets or self.sets[id].round != round:
+            return False
+
+        self._set_table = None
+        self.round_digests.pop(self.set_rounds[id], None)
+        old_set = self.sets[id]
+        set = Set(id, phase, round, display_score, winner_id, identifier, is_gf, completed, slots, stream, self.entrants)
+        self.sets[id] = set
+
+        # Sets in unbalanced rounds are dropped from the rounds on finalize.
+        round_sets = self.rounds.get(self.set_rounds[id], [])
+        for i, round_set in enumerate(round_sets):
+            if round_set is old_set:
+                round_sets[i] = set
+
+        self._add_entrants(set)
+        return True
+
+
     def __remove_unbalanced_rounds(self, rounds):
         if len(rounds) in [0, 1]:
             return
@@ -219,7 +487,7 @@ class Bracket(object):
         self.__remove_unbalanced_rounds(self.lb_rounds)
 
 
-    def _connect_bracket_sets(self):
+    def _settle_rounds(self):
         # Sort each round by set identifier to replicate smash.gg exactly. First
         # sorts by length, and then alphabetically, e.g. X -> Y -> Z -> AA.
         def set_sort_key(set):
@@ -237,68 +505,126 @@ class Bracket(object):
             self.rounds[gf_round] = [gf_sets[0]]
             self.rounds[gf_round+1] = []
             self.rounds[gf_round+1].append(gf_sets[1])
+            self.set_rounds[gf_sets[1].id] = gf_round+1
 
-        # Connect sets to previous sets using the prereq identifier from
-        # smash.gg. Not used for anything at the moment, but we might need to
-        # know which sets lead to where in the future.
+
+    def _connect_bracket_sets(self):
+        # Connect sets using the prereqs from smash.gg: a slot with a set
+        # prereq is filled by that set's winner, or its loser for placement 2.
+        # Everything is keyed by set id, so it stays valid through update_set.
+        next_sets = defaultdict(list)
         for set in self.sets.values():
             for slot in set.slots:
-                if slot.prereq == 'set':
-                    child_set = self.sets[slot.prereq.id]
-                    set._add_child(child_set)
-                    child_set._add_parent(self)
+                prereq = slot.prereq
+                if prereq.type != 'set' or prereq.id not in self.sets:
+                    continue
+                self.set_feeders.setdefault(set.id, []).append(prereq.id)
+                next_sets[prereq.id].append(set.id)
+                if prereq.placement == 2:
+                    self.loser_goes_to[prereq.id] = set.id
+                else:
+                    self.winner_goes_to[prereq.id] = set.id
+
+        # Depths in topological order, so every set comes after its feeders.
+        waiting_on = {id: len(self.set_feeders.get(id, [])) for id in self.sets}
+        queue = deque(id for id, count in waiting_on.items() if count == 0)
+        while queue:
+            id = queue.popleft()
+            self.set_depths[id] = 1 + max((self.set_depths[f] for f in self.set_feeders.get(id, [])), default=0)
+            for next_id in next_sets[id]:
+                waiting_on[next_id] -= 1
+                if waiting_on[next_id] == 0:
+                    queue.append(next_id)
+
+
+    def _index_entrants(self):
+        self.entrant_sets = {}
+        for set in self.sets.values():
+            for slot in set.slots:
+                if slot.decided:
+                    self.entrant_sets.setdefault(slot.entrant.id, []).append(set.id)
+
+
+    def feeders(self, set_id):
+        return [self.sets[id] for id in self.set_feeders.get(set_id, [])]
+
+
+    def path(self, entrant_id):
+        # Every set an entrant has played or is waiting to play, in the order
+        # they come in the bracket.
+        def path_order(set):
+            return self.set_depths.get(set.id, 0), abs(set.round)
+        return sorted((self.sets[id] for id in self.entrant_sets.get(entrant_id, [])), key=path_order)
+
+
+    def next_set(self, entrant_id):
+        for set in self.path(entrant_id):
+            if not set.completed:
+                return set
+        return None
+
+
+    def next_opponent(self, entrant_id):
+        # Whoever the entrant plays next. If that isn't decided yet, assume
+        # the better seed wins each set that leads there.
+        set = self.next_set(entrant_id)
+        if set is None:
+            return None
+        for slot in set.slots:
+            if slot.decided and slot.entrant.id == entrant_id:
+                continue
+            if slot.decided:
+                return slot.entrant
+            return self._projected_entrant(slot)
+        return None
+
+
+    def _projected_entrant(self, slot):
+        if slot.decided:
+            return slot.entrant
+        prereq = slot.prereq
+        if prereq.type != 'set' or prereq.id not in self.sets:
+            return None
+        entrants = [self._projected_entrant(feeder_slot) for feeder_slot in self.sets[prereq.id].slots]
+        if None in entrants:
+            return None
+        winner, loser = sorted(entrants, key=lambda entrant: entrant.seed)
+        return loser if prereq.placement == 2 else winner
 
 
     def _finalize_pools(self):
-        # (TODO): Dont duplicate entrants, this is a suspicious approach.
-        # If anyone has the same seed, replace one with an increment of
-        # 0.5.
+        # Entrants can share a seed (e.g. when seeded from different phases);
+        # later ones get half a seed more so the order stays well defined.
         seeds = {}
-        for set in self.sets.values():
-            for slot in set.slots:
-                entrant = slot.entrant
-                if entrant.id in seeds:
-                    entrant.seed = seeds[entrant.id]
-                else:
-                    if entrant.seed in seeds.values():
-                        entrant.seed += 0.5
-                    seeds[entrant.id] = entrant.seed
+        for entrant in self.entrants.values():
+            if seeds.get(entrant.seed, entrant.id) != entrant.id:
+                entrant.seed += 0.5
+            seeds.setdefault(entrant.seed, entrant.id)
 
         def entrant_sort_key(entrant):
             return entrant.seed, entrant.name
-        pool_entrants = list(self.entrants.values())
-        pool_entrants.sort(key=entrant_sort_key)
-
-        seed_translation = {}
-        for i, entrant in enumerate(pool_entrants):
-            seed_translation[entrant.seed] = i
+        pool_entrants = sorted(self.entrants.values(), key=entrant_sort_key)
 
         self.pool_entrants = [(entrant.name, entrant.participant_id) for entrant in pool_entrants]
-
-        self.pool_sets = [[0]*len(self.pool_entrants) for _ in self.pool_entrants]
-        for set in self.sets.values():
-            if set.slots[0].entrant.id == set.winner_id:
-                winner = set.slots[0].entrant
-                loser = set.slots[1].entrant
-            else:
-                winner = set.slots[1].entrant
-                loser = set.slots[0].entrant
-
-            winner_index = seed_translation[winner.seed]
-            loser_index = seed_translation[loser.seed]
-            self.pool_sets[winner_index][loser_index] = PoolResult(set.completed, winner.score, loser.score)
-            self.pool_sets[loser_index][winner_index] = PoolResult(set.completed, loser.score, winner.score)
+        self.pool = PoolResults(pool_entrants, self.set_table())
 
 
     def finalize(self):
-        if self.type == BracketType.DOUBLE_ELIMINATION:
-            self._connect_bracket_sets()
-            return
-        elif self.type == BracketType.SINGLE_ELIMINATION:
-            self._connect_bracket_sets()
-            return
+        # Safe to call again after update_set: the bracket shape and set graph
+        # are only settled once, while who plays where and pool results are
+        # recomputed every time.
+        if self.type in [BracketType.DOUBLE_ELIMINATION, BracketType.SINGLE_ELIMINATION]:
+            if not self.finalized:
+                self._settle_rounds()
+                self._connect_bracket_sets()
+                self.layout = BracketLayout(self)
+                self.round_digests = {}
+            # Worked out here so they are cached along with the bracket.
+            for round in self.layout.round_boxes:
+                self.round_digest(round)
         elif self.type == BracketType.ROUND_ROBIN:
             self._finalize_pools()
-            return
         else:
             raise ValueError(f'Invalid bracket type {self.type}')
+        self._index_entrants()
+        self.finalized = True
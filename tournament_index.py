@@ -0,0 +1,120 @@
+import bisect
+import os
+import threading
+import time
+
+
+def _tokens(text):
+    # Lower case words with anything but letters and digits left out, the
+    # way tournament names have always been matched.
+    tokens = []
+    for word in text.lower().replace('-', ' ').split():
+        token = ''.join(filter(str.isalnum, word))
+        if token:
+            tokens.append(token)
+    return tokens
+
+
+def _words(tournament):
+    # Slugs look like tournament/genesis-9, the first part is the same for
+    # all of them.
+    slug = (tournament.get('slug') or '').rpartition('/')[2]
+    return _tokens(tournament['name']) + _tokens(slug)
+
+
+def _closest_first(tournaments):
+    now = time.time()
+    return sorted(tournaments, key=lambda tournament: abs(tournament['startAt'] - now))
+
+
+def matching(tournaments, text):
+    # The tournaments search(text) would find among these, for results the
+    # index can't vouch for.
+    terms = _tokens(text)
+    return _closest_first([tournament for tournament in tournaments
+                           if all(any(word.startswith(term) for word in _words(tournament)) for term in terms)])
+
+
+class TournamentIndex(object):
+    # Every Melee tournament we've heard of, searchable by prefixes of the
+    # words in its name and slug. Grows with each upstream search and each
+    # list of coming tournaments, so most searches never leave the process.
+    def __init__(self, ttl=None):
+        # How long an upstream search vouches for the searches it covers.
+        self.ttl = ttl or float(os.getenv('GG_SEARCH_INDEX_TTL', 60*60))
+        self.lock = threading.Lock()
+        self.tournaments = {}
+        self.postings = {}
+        self.words = []
+        self.searched = {}
+
+
+    def add(self, tournaments, search=None):
+        # tournaments are dicts with id, name, startAt and optionally slug.
+        # With search, they are everything start.gg has for it.
+        with self.lock:
+            for tournament in tournaments:
+                self.tournaments[tournament['id']] = tournament
+                for token in _words(tournament):
+                    if token not in self.postings:
+                        self.postings[token] = set()
+                        bisect.insort(self.words, token)
+                    self.postings[token].add(tournament['id'])
+            now = time.time()
+            self.searched = {searched: searched_at for searched, searched_at in self.searched.items()
+                             if now - searched_at <= self.ttl}
+            if search is not None and _tokens(search):
+                self.searched[tuple(_tokens(search))] = now
+
+
+    def _covered(self, terms):
+        # start.gg matches names loosely, so an earlier search found every
+        # tournament for terms that include or extend each of its words.
+        now = time.time()
+        for searched, searched_at in self.searched.items():
+            if now - searched_at <= self.ttl and all(
+                    any(term.startswith(word) for term in terms) for word in searched):
+                return True
+        return False
+
+
+    def _matching(self, prefix):
+        ids = set()
+        i = bisect.bisect_left(self.words, prefix)
+        while i < len(self.words) and self.words[i].startswith(prefix):
+            ids |= self.postings[self.words[i]]
+            i += 1
+        return ids
+
+
+    def search(self, text):
+        # Tournaments with a word starting with each word of text, those
+        # closest to today first. None for a miss: nothing matches, or an
+        # upstream search hasn't recently covered text.
+        terms = _tokens(text)
+        if not terms:
+            return None
+        with self.lock:
+            if not self._covered(terms):
+                return None
+            ids = None
+            for term in sorted(terms, key=len, reverse=True):
+                matching = self._matching(term)
+                ids = matching if ids is None else ids & matching
+                if not ids:
+                    return None
+            tournaments = [self.tournaments[id] for id in ids]
+        return _closest_first(tournaments)
+
+
+_shared_tournament_index = None
+_shared_tournament_index_lock = threading.Lock()
+
+
+def shared_tournament_index():
+    global _shared_tournament_index
+    if _shared_tournament_index is None:
+        with _shared_tournament_index_lock:
+            if _shared_tournament_index is None:
+                _shared_tournament_index = TournamentIndex()
+    return _shared_tournament_index
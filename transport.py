@@ -0,0 +1,54 @@
+import os
+import threading
+
+
+class Transport(object):
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None):
+        # requests is one of the slower imports of the app, and a process
+        # serving only cached pages never needs it.
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.pool_size = pool_size or int(os.getenv('GG_HTTP_POOL_SIZE', 10))
+        self.connect_timeout = connect_timeout or float(os.getenv('GG_HTTP_CONNECT_TIMEOUT', 3.05))
+        self.read_timeout = read_timeout or float(os.getenv('GG_HTTP_READ_TIMEOUT', 20))
+
+        # One keep-alive pool per host, shared by every thread in the process.
+        # pool_block makes callers wait for a free connection instead of
+        # opening throwaway ones past pool_size. Retries are left to the
+        # caller, who knows whether a request is safe to repeat.
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size,
+                              pool_block=True, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+
+    def post(self, url, json, headers):
+        return self.session.post(url, json=json, headers=headers, timeout=self.timeout)
+
+
+    def get(self, url, headers):
+        return self.session.get(url, headers=headers, timeout=self.timeout)
+
+
+    def close(self):
+        self.session.close()
+
+
+_shared_transport = None
+_shared_transport_lock = threading.Lock()
+
+
+def shared_transport():
+    global _shared_transport
+    if _shared_transport is None:
+        with _shared_transport_lock:
+            if _shared_transport is None:
+                _shared_transport = Transport()
+    return _shared_transport